@@ -0,0 +1,236 @@
+"""Benchmark invoice rendering as baskets grow.
+
+Renders invoices with an increasing number of line items against an in-memory
+sheet connection and records wall time, peak memory and PDF size as JSON so
+runs from different commits can be compared. Each size is rendered in every
+requested PDF output mode and a size report compares the modes. Each size and
+mode runs in its own subprocess, because peak RSS is a per-process high-water
+mark and would otherwise carry over from the largest size measured so far.
+
+Usage (from the repository root):
+    python invoice_benchmark.py
+    python invoice_benchmark.py --sizes 1 10 100 1000 --repeat 5
+    python invoice_benchmark.py --modes compact
+    python invoice_benchmark.py --compare bench_results/invoice_abc1234.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+DEFAULT_SIZES = [1, 10, 100, 1000]
+DEFAULT_MODES = ["compact", "standard"]
+RESULTS_DIR = "bench_results"
+
+
+class FakeSheetConnection:
+    """In-memory stand-in for the GSheetsConnection used by the app"""
+
+    def __init__(self):
+        self.sheets = {}
+        self.reads = 0
+        self.writes = 0
+
+    def reset(self):
+        self.sheets = {}
+        self.reads = 0
+        self.writes = 0
+
+    def read(self, worksheet=None, usecols=None, ttl=None, **kwargs):
+        self.reads += 1
+        data = self.sheets.get(worksheet, pd.DataFrame())
+        if usecols is not None and not data.empty:
+            data = data.iloc[:, [c for c in usecols if c < data.shape[1]]]
+        return data.copy()
+
+    def update(self, worksheet=None, data=None, **kwargs):
+        self.writes += 1
+        self.sheets[worksheet] = data.copy()
+        return data
+
+    def create(self, worksheet=None, data=None, **kwargs):
+        return self.update(worksheet=worksheet, data=data)
+
+    def list_worksheets(self):
+        return list(self.sheets)
+
+
+def load_app(fake_conn):
+    """Import streamlit_app with its sheet connection replaced by fake_conn"""
+    os.environ.setdefault("INVOICE_ARCHIVE", "false")
+    st.connection = lambda *args, **kwargs: fake_conn
+    import streamlit_app
+    return streamlit_app
+
+
+def build_basket(app, size):
+    product_names = app.Products['Product Name'].tolist()
+    products = [product_names[i % len(product_names)] for i in range(size)]
+    quantities = [(i % 12) + 1 for i in range(size)]
+    discounts = [float((i % 3) * 5) for i in range(size)]
+    return products, quantities, discounts
+
+
+def render_once(app, size, invoice_number):
+    employee = app.Person.iloc[0]
+    products, quantities, discounts = build_basket(app, size)
+    pdf_bytes, _ = app.generate_invoice(
+        "Benchmark Outlet", "09AAAAA0000A1Z5", "9999999999", "1 Benchmark Street", "Uttar Pradesh", "Noida",
+        products, quantities, discounts, employee['Discount Category'], employee['Employee Name'],
+        "pending", 0.0, None, None, invoice_number, "Sold",
+        "Benchmark Distributor", "B0D0S00000", "Contact Person", "9999999999",
+        "bench@example.com", "Noida", "", "01-01-2025"
+    )
+    return pdf_bytes
+
+
+def bench_size(app, fake_conn, size, repeat, mode):
+    app.INVOICE_PDF_MODE = mode
+    baseline_rss = peak_rss_mb()
+    timings = []
+    output_size = 0
+    for run in range(repeat):
+        fake_conn.reset()
+        start = time.perf_counter()
+        pdf_bytes = render_once(app, size, f"INV-BENCH-{size}-{run}")
+        timings.append(time.perf_counter() - start)
+        output_size = len(pdf_bytes)
+
+    fake_conn.reset()
+    tracemalloc.start()
+    render_once(app, size, f"INV-BENCH-{size}-mem")
+    _, peak_alloc = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "pdf_mode": mode,
+        "line_items": size,
+        "runs": repeat,
+        "wall_time_s": {
+            "min": min(timings),
+            "median": statistics.median(timings),
+            "max": max(timings),
+        },
+        "peak_alloc_mb": peak_alloc / (1024 * 1024),
+        "peak_rss_mb": peak_rss_mb(),
+        "rss_increase_mb": peak_rss_mb() - baseline_rss,
+        "output_bytes": output_size,
+        "sheet_reads": fake_conn.reads,
+        "sheet_writes": fake_conn.writes,
+    }
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def bench_isolated(size, repeat, mode):
+    """Run bench_size for one size and mode in a fresh interpreter and return its result"""
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", "--sizes", str(size), "--modes", mode, "--repeat", str(repeat)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def size_report(results):
+    """Summarise output size per line item count across PDF modes"""
+    report = {}
+    for result in results:
+        report.setdefault(str(result["line_items"]), {})[result["pdf_mode"]] = result["output_bytes"]
+    for sizes in report.values():
+        if "compact" in sizes and sizes.get("standard"):
+            sizes["compact_saving_pct"] = (1 - sizes["compact"] / sizes["standard"]) * 100
+    return report
+
+
+def compare_results(current, baseline):
+    previous = {(r.get("pdf_mode", "standard"), r["line_items"]): r for r in baseline.get("results", [])}
+    print(f"\nComparison against {baseline.get('commit', 'baseline')}:")
+    for result in current["results"]:
+        before = previous.get((result["pdf_mode"], result["line_items"]))
+        if not before:
+            continue
+        for label, now, then in [
+            ("median time", result["wall_time_s"]["median"], before["wall_time_s"]["median"]),
+            ("peak alloc", result["peak_alloc_mb"], before["peak_alloc_mb"]),
+            ("output size", result["output_bytes"], before["output_bytes"]),
+        ]:
+            change = ((now - then) / then * 100) if then else 0.0
+            print(f"  {result['pdf_mode']:<8} {result['line_items']:>5} items  {label:<12} {then:>12.4f} -> {now:>12.4f}  ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark generate_invoice rendering")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Line item counts to render")
+    parser.add_argument("--modes", nargs="+", default=DEFAULT_MODES, help="PDF output modes to render")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per size")
+    parser.add_argument("--output", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Previous results JSON to compare against")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        fake_conn = FakeSheetConnection()
+        app = load_app(fake_conn)
+        print(json.dumps(bench_size(app, fake_conn, args.sizes[0], args.repeat, args.modes[0])))
+        return
+
+    commit = current_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": [],
+    }
+    for mode in args.modes:
+        for size in args.sizes:
+            result = bench_isolated(size, args.repeat, mode)
+            report["results"].append(result)
+            print(
+                f"{mode:<8} {size:>5} items  median {result['wall_time_s']['median'] * 1000:9.1f} ms  "
+                f"peak alloc {result['peak_alloc_mb']:7.2f} MB  peak RSS {result['peak_rss_mb']:7.1f} MB  "
+                f"output {result['output_bytes'] / 1024:8.1f} KB"
+            )
+    report["size_report"] = size_report(report["results"])
+    for size, sizes in report["size_report"].items():
+        if "compact_saving_pct" in sizes:
+            print(f"{size:>5} items  compact output is {sizes['compact_saving_pct']:.1f}% smaller than standard")
+
+    output_path = args.output or os.path.join(RESULTS_DIR, f"invoice_{commit}.json")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output_path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import streamlit as st
 from streamlit_gsheets import GSheetsConnection
+from gspread.exceptions import WorksheetNotFound
 import pandas as pd
+import numpy as np
 from fpdf import FPDF
 from datetime import datetime, time
 import os
@@ -11,9 +13,29 @@ import pytz
 import streamlit.components.v1 as components
 from streamlit_js_eval import streamlit_js_eval
 import time
+import threading
+import io
+import zipfile
+import gzip
+import bisect
+import itertools
+import re
+import math
+import heapq
+import json
+import atexit
+import logging
+from collections import defaultdict, deque
 from streamlit_cookies_manager import EncryptedCookieManager
 import extra_streamlit_components as stx
 
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+logger = logging.getLogger(__name__)
+
 cookies = EncryptedCookieManager(
     prefix="biolume_",
     password=os.environ.get("COOKIE_PASSWORD", "default-cookie-password")
@@ -53,18 +75,333 @@ def log_location_history(conn, employee_name, lat, lng):
         "Google Maps Link": gmaps_link
     }
     try:
-        existing = conn.read(worksheet="LocationHistory", usecols=list(range(len(LOCATION_HISTORY_COLUMNS))), ttl=5)
-        existing = existing.dropna(how="all")
-        new_df = pd.DataFrame([entry], columns=LOCATION_HISTORY_COLUMNS)
-        updated = pd.concat([existing, new_df], ignore_index=True)
-        conn.update(worksheet="LocationHistory", data=updated)
+        get_location_buffer().add(entry)
         return True, None
     except Exception as e:
         return False, str(e)
 
+class LocationPingBuffer:
+    """Process-level queue of location pings, appended to LocationHistory in bulk"""
+
+    def __init__(self, interval, max_points):
+        self.interval = interval
+        self.max_points = max_points
+        self.pending = deque()
+        self.last_point = {}
+        self.last_error = None
+        self.flushed_at = time.time()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker = None
+
+    def add(self, entry):
+        """Queue a ping unless it repeats the employee's previous coordinates that day within the flush interval; returns whether it was queued"""
+        point = (entry["Date"], round(float(entry["Latitude"]), 6), round(float(entry["Longitude"]), 6))
+        now = time.time()
+        with self._lock:
+            # Only rapid repeats (reruns, double submits) are dropped: a rep who stays put still gets hourly pings
+            last = self.last_point.get(entry["Employee Code"])
+            if last is not None and last[0] == point and now - last[1] < self.interval:
+                return False
+            self.last_point[entry["Employee Code"]] = (point, now)
+            self.pending.append(entry)
+            # While the sheet is failing, leave retries to the interval rather than one per ping
+            full = len(self.pending) >= self.max_points and self.last_error is None
+        self._ensure_worker()
+        if full:
+            # Flushing here would make this rep's request wait on a full LocationHistory rewrite
+            self._wake.set()
+        return True
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self.pending)
+                self.pending.clear()
+            if not batch:
+                return True, None
+            try:
+                write_location_rows(conn, pd.DataFrame(batch, columns=LOCATION_HISTORY_COLUMNS))
+                self.last_error = None
+                self.flushed_at = time.time()
+                return True, None
+            except Exception as e:
+                # Put the batch back in front so ordering is kept for the next attempt
+                with self._lock:
+                    self.pending.extendleft(reversed(batch))
+                self.last_error = str(e)
+                return False, str(e)
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="location-flush", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+def read_sheet_or_empty(conn, worksheet, columns):
+    """Read a worksheet the app maintains itself, treating a missing one as empty"""
+    try:
+        data = conn.read(worksheet=worksheet, usecols=list(range(len(columns))), ttl=5)
+    except WorksheetNotFound:
+        return pd.DataFrame(columns=columns)
+    return data.dropna(how='all').reindex(columns=columns)
+
+def replace_sheet(conn, worksheet, data):
+    """Overwrite a worksheet the app maintains itself, creating it on first write"""
+    try:
+        conn.update(worksheet=worksheet, data=data)
+    except WorksheetNotFound:
+        conn.create(worksheet=worksheet, data=data)
+
+def partition_name(sheet, month):
+    return f"{sheet}_{month.strftime('%Y_%m')}"
+
+def _partition_columns(sheet):
+    return PARTITIONED_SHEETS[sheet]
+
+def append_partitioned_rows(conn, sheet, rows, dedupe_column=None):
+    """Route rows to the monthly worksheet of their Date, one read and one write per month touched"""
+    columns = _partition_columns(sheet)
+    rows = rows.reindex(columns=columns)
+    months = pd.to_datetime(rows["Date"], format="%d-%m-%Y", errors='coerce').dt.to_period("M")
+    months = months.fillna(pd.Period(get_ist_time().strftime("%Y-%m"), freq="M"))
+    for month, chunk in rows.groupby(months, sort=True):
+        worksheet = partition_name(sheet, month)
+        try:
+            existing = conn.read(worksheet=worksheet, usecols=list(range(len(columns))), ttl=5)
+        except WorksheetNotFound:
+            conn.create(worksheet=worksheet, data=chunk)
+            continue
+        updated = pd.concat([existing.dropna(how="all"), chunk], ignore_index=True)
+        if dedupe_column:
+            updated = updated.drop_duplicates(subset=[dedupe_column], keep="last")
+        conn.update(worksheet=worksheet, data=updated)
+
+def read_partitioned_rows(conn, sheet, start_date, end_date):
+    """Rows dated within [start_date, end_date], loading only the monthly worksheets the range touches"""
+    columns = _partition_columns(sheet)
+    if MONTHLY_PARTITIONS_ENABLED:
+        # Rows written before the switch stay visible until the sheet has been split
+        frames = [read_unmigrated_rows(sheet)]
+        for month in pd.period_range(pd.Timestamp(start_date), pd.Timestamp(end_date), freq="M"):
+            try:
+                frames.append(conn.read(worksheet=partition_name(sheet, month), usecols=list(range(len(columns))), ttl=5))
+            except WorksheetNotFound:
+                continue
+        rows = pd.concat([frame.dropna(how="all").reindex(columns=columns) for frame in frames], ignore_index=True)
+        id_column = PARTITION_ID_COLUMNS.get(sheet)
+        rows = rows.drop_duplicates(subset=[id_column] if id_column else None, keep="last")
+    else:
+        rows = conn.read(worksheet=sheet, usecols=list(range(len(columns))), ttl=5)
+    rows = rows.dropna(how="all").reindex(columns=columns)
+    dates = pd.to_datetime(rows["Date"], format="%d-%m-%Y", errors='coerce')
+    return rows[(dates >= pd.Timestamp(start_date)) & (dates <= pd.Timestamp(end_date))]
+
+@st.cache_data(ttl=300)
+def read_unmigrated_rows(sheet):
+    """Rows left in the unpartitioned sheet after switching to monthly worksheets; nothing writes there any more"""
+    return read_sheet_or_empty(conn, sheet, _partition_columns(sheet))
+
+def split_sheet_into_partitions(conn, sheet):
+    """One-off migration of an unpartitioned sheet's rows into its monthly worksheets, emptying the sheet afterwards"""
+    columns = _partition_columns(sheet)
+    rows = read_sheet_or_empty(conn, sheet, columns)
+    if rows.empty:
+        return 0
+    append_partitioned_rows(conn, sheet, rows, PARTITION_ID_COLUMNS.get(sheet))
+    # Only emptied once every month has been written, so the rows are never in neither place
+    replace_sheet(conn, sheet, pd.DataFrame(columns=columns))
+    read_unmigrated_rows.clear()
+    return len(rows)
+
+def write_location_rows(conn, rows):
+    """Append a batch of location rows to LocationHistory in one read and one write"""
+    if LOCATION_STORAGE_MODE == "trail":
+        write_location_trails(conn, rows)
+        return
+    if MONTHLY_PARTITIONS_ENABLED:
+        append_partitioned_rows(conn, "LocationHistory", rows)
+        return
+    existing = conn.read(worksheet="LocationHistory", usecols=list(range(len(LOCATION_HISTORY_COLUMNS))), ttl=5)
+    existing = existing.dropna(how="all")
+    updated = pd.concat([existing, rows], ignore_index=True)
+    conn.update(worksheet="LocationHistory", data=updated)
+
+def _encode_signed(value):
+    """One signed integer in Google's encoded-polyline character format"""
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return "".join(chunks)
+
+def _decode_signed(text):
+    result = shift = 0
+    for char in text:
+        byte = ord(char) - 63
+        result |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            yield ~(result >> 1) if result & 1 else result >> 1
+            result = shift = 0
+
+def encode_polyline(points, precision=1e5):
+    coords = [int(round(value * precision)) for point in points for value in point]
+    # Latitude and longitude deltas are interleaved, each against its own previous value
+    return "".join(_encode_signed(current - previous) for current, previous in zip(coords, [0, 0] + coords[:-2]))
+
+def decode_polyline(text, precision=1e5):
+    deltas = list(_decode_signed(str(text)))
+    lats = itertools.accumulate(deltas[0::2])
+    lngs = itertools.accumulate(deltas[1::2])
+    return [(lat / precision, lng / precision) for lat, lng in zip(lats, lngs)]
+
+def encode_polylines(lat, lng, starts, precision=1e5):
+    """Encode many routes at once; starts holds the index of each route's first point"""
+    coords = np.round(np.column_stack([lat, lng]) * precision).astype(np.int64)
+    deltas = np.diff(coords, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    deltas[starts] = coords[starts]
+    values = deltas.ravel()
+    values = np.where(values < 0, ~(values << 1), values << 1)
+    
+    shifts = np.arange(7) * 5
+    chunks = (values[:, None] >> shifts) & 0x1f
+    counts = 1 + ((values[:, None] >> shifts[1:]) > 0).sum(axis=1)
+    continued = np.arange(7) < (counts[:, None] - 1)
+    characters = (chunks | np.where(continued, 0x20, 0)) + 63
+    text = characters[np.arange(7) < counts[:, None]].astype(np.uint8).tobytes().decode("ascii")
+    
+    # Two encoded values per point, so a point's first character sits at every other offset
+    point_offsets = np.concatenate([[0], np.cumsum(counts)])[::2]
+    bounds = point_offsets[np.append(starts, len(coords))]
+    return [text[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+def encode_times(minutes):
+    return "".join(_encode_signed(current - previous) for current, previous in zip(minutes, [0] + minutes[:-1]))
+
+def decode_times(text):
+    return list(itertools.accumulate(_decode_signed(str(text))))
+
+def _clock_minutes(time_str):
+    hours, minutes = str(time_str).split(":")[:2]
+    return int(hours) * 60 + int(minutes)
+
+def simplify_trail(points, tolerance_m):
+    """Douglas-Peucker simplification in metres; returns the indices of the points to keep"""
+    if len(points) < 3:
+        return list(range(len(points)))
+    coords = np.radians(np.asarray(points, dtype=float))
+    # Equirectangular projection is accurate enough over a single day's travel
+    xy = np.column_stack([coords[:, 1] * np.cos(coords[:, 0].mean()), coords[:, 0]]) * EARTH_RADIUS_M
+    keep = np.zeros(len(xy), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(xy) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end <= start + 1:
+            continue
+        segment = xy[end] - xy[start]
+        offsets = xy[start + 1:end] - xy[start]
+        length = np.hypot(segment[0], segment[1])
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance_m:
+            split = start + 1 + index
+            keep[split] = True
+            stack.extend([(start, split), (split, end)])
+    return np.flatnonzero(keep).tolist()
+
+def decode_trail(trail):
+    """Points and minutes-since-midnight of one stored trail row"""
+    if not isinstance(trail.get("Trail"), str) or not trail["Trail"]:
+        return [], []
+    return decode_polyline(trail["Trail"]), decode_times(trail["Times"])
+
+def write_location_trails(conn, rows):
+    """Merge a batch of pings into each employee's simplified, delta-encoded daily trail"""
+    existing = read_sheet_or_empty(conn, LOCATION_TRAILS_SHEET, LOCATION_TRAIL_COLUMNS)
+    trails = {(str(trail["Employee Code"]), str(trail["Date"])): trail for trail in existing.to_dict("records")}
+    
+    for (employee_code, date_str), pings in rows.groupby(["Employee Code", "Date"], sort=False):
+        key = (str(employee_code), str(date_str))
+        trail = trails.get(key, {})
+        points, minutes = decode_trail(trail)
+        points += list(zip(pings["Latitude"].astype(float), pings["Longitude"].astype(float)))
+        minutes += [_clock_minutes(t) for t in pings["Time"]]
+        keep = simplify_trail(points, LOCATION_TRAIL_TOLERANCE_M)
+        first = pings.iloc[0]
+        trails[key] = {
+            "Employee Name": first["Employee Name"],
+            "Employee Code": employee_code,
+            "Designation": first["Designation"],
+            "Date": date_str,
+            "Points": len(keep),
+            "Raw Points": int(_sheet_number(trail, "Raw Points")) + len(pings),
+            "Trail": encode_polyline([points[i] for i in keep]),
+            "Times": encode_times([minutes[i] for i in keep])
+        }
+    
+    replace_sheet(conn, LOCATION_TRAILS_SHEET, pd.DataFrame(list(trails.values()), columns=LOCATION_TRAIL_COLUMNS))
+
+def trails_to_location_rows(trails):
+    """Expand stored trails back into one row per kept point, with maps links derived on the fly"""
+    frames = []
+    for trail in trails.to_dict("records"):
+        points, minutes = decode_trail(trail)
+        if not points:
+            continue
+        frames.append(pd.DataFrame({
+            "Employee Name": trail["Employee Name"],
+            "Employee Code": trail["Employee Code"],
+            "Designation": trail["Designation"],
+            "Date": trail["Date"],
+            "Time": [f"{m // 60:02d}:{m % 60:02d}" for m in minutes],
+            "Latitude": [lat for lat, _ in points],
+            "Longitude": [lng for _, lng in points]
+        }))
+    if not frames:
+        return pd.DataFrame(columns=LOCATION_HISTORY_COLUMNS)
+    rows = pd.concat(frames, ignore_index=True)
+    rows["Google Maps Link"] = "https://maps.google.com/?q=" + rows["Latitude"].astype(str) + "," + rows["Longitude"].astype(str)
+    return rows[LOCATION_HISTORY_COLUMNS]
+
+def read_location_history(conn, start_date, end_date):
+    """Location pings dated within the range as LocationHistory rows, whichever storage mode wrote them"""
+    if LOCATION_STORAGE_MODE == "trail":
+        trails = read_sheet_or_empty(conn, LOCATION_TRAILS_SHEET, LOCATION_TRAIL_COLUMNS)
+        dates = pd.to_datetime(trails["Date"], format="%d-%m-%Y", errors='coerce')
+        trails = trails[(dates >= pd.Timestamp(start_date)) & (dates <= pd.Timestamp(end_date))]
+        return trails_to_location_rows(trails)
+    return read_partitioned_rows(conn, "LocationHistory", start_date, end_date)
+
+@st.cache_resource
+def get_location_buffer():
+    buffer = LocationPingBuffer(LOCATION_FLUSH_INTERVAL, LOCATION_FLUSH_POINTS)
+    atexit.register(buffer.flush)
+    return buffer
+
 def hourly_location_auto_log(conn, selected_employee):
     if not selected_employee:
         return
+    # Decide before touching the browser: the geolocation component is only mounted when a log is due
+    last_attempt = max(
+        st.session_state.get("location_logged_at", 0),
+        st.session_state.get("location_denied_at", 0)
+    )
+    if time.time() - last_attempt < LOCATION_LOG_INTERVAL:
+        return
+    
     result = streamlit_js_eval(
         js_expressions="""
             new Promise((resolve) => {
@@ -78,19 +415,22 @@ def hourly_location_auto_log(conn, selected_employee):
                 }
             });
         """,
-        key=f"geo_hourly_{int(time.time() // 3600)}"
-    ) or {}
+        key=f"geo_hourly_{int(last_attempt)}"
+    )
+    if result is None:
+        # The browser has not answered yet; the component stays mounted until it does
+        return
 
     lat = result.get("latitude")
     lng = result.get("longitude")
 
     if lat and lng:
-        current_hour = datetime.now(pytz.timezone('Asia/Kolkata')).strftime("%Y-%m-%d %H")
-        logged_key = f"hourly_logged_{selected_employee}_{current_hour}"
-        if not st.session_state.get(logged_key, False):
-            success, error = log_location_history(conn, selected_employee, lat, lng)
-            if success:
-                st.session_state[logged_key] = True
+        success, error = log_location_history(conn, selected_employee, lat, lng)
+        if success:
+            st.session_state.location_logged_at = time.time()
+    else:
+        # Permission denied or unavailable: wait a full interval before asking the browser again
+        st.session_state.location_denied_at = time.time()
 
 st.set_page_config(page_title="Location Logger", layout="centered")
 
@@ -254,6 +594,38 @@ SALES_SHEET_COLUMNS = [
 ]
 
 SALES_HISTORY_SHEET = "SalesHistory"
+INVOICE_SUMMARY_SHEET = "InvoiceSummary"
+DERIVED_SHEET_REBUILD_INTERVAL = int(os.environ.get("DERIVED_SHEET_REBUILD_INTERVAL", 6 * 3600))
+INVOICE_SUMMARY_COLUMNS = [
+    "Invoice Number",
+    "Invoice Date",
+    "Employee Name",
+    "Employee Code",
+    "Outlet Name",
+    "Grand Total",
+    "Payment Status",
+    "Delivery Status",
+    "Line Items"
+]
+
+MONTHLY_PARTITIONS_ENABLED = os.environ.get("MONTHLY_PARTITIONS", "false").lower() == "true"
+LOCATION_LOG_INTERVAL = 3600
+LOCATION_FLUSH_INTERVAL = int(os.environ.get("LOCATION_FLUSH_INTERVAL", "60"))
+LOCATION_FLUSH_POINTS = int(os.environ.get("LOCATION_FLUSH_POINTS", "50"))
+LOCATION_STORAGE_MODE = os.environ.get("LOCATION_STORAGE_MODE", "rows").lower()
+LOCATION_TRAIL_TOLERANCE_M = float(os.environ.get("LOCATION_TRAIL_TOLERANCE_M", "25"))
+LOCATION_TRAILS_SHEET = "LocationTrails"
+LOCATION_TRAIL_COLUMNS = [
+    "Employee Name",
+    "Employee Code",
+    "Designation",
+    "Date",
+    "Points",
+    "Raw Points",
+    "Trail",
+    "Times"
+]
+EARTH_RADIUS_M = 6371000
 LOCATION_HISTORY_COLUMNS = [
     "Employee Name",
     "Employee Code",
@@ -297,9 +669,19 @@ ATTENDANCE_SHEET_COLUMNS = [
     "Location Link",
     "Leave Reason",
     "Check-in Time",
-    "Check-in Date Time"
+    "Check-in Date Time",
+    "Geofence Status",
+    "Nearest Location",
+    "Distance (m)"
 ]
 
+# Sheets split into one worksheet per month (e.g. LocationHistory_2026_10) when MONTHLY_PARTITIONS is on
+PARTITIONED_SHEETS = {
+    "LocationHistory": LOCATION_HISTORY_COLUMNS,
+    "Attendance": ATTENDANCE_SHEET_COLUMNS
+}
+PARTITION_ID_COLUMNS = {"Attendance": "Attendance ID"}
+
 TICKET_SHEET_COLUMNS = [
     "Ticket ID",
     "Raised By (Employee Name)",
@@ -367,6 +749,9 @@ DEMO_SHEET_COLUMNS = [
 ]
 
 DEMO_HISTORY_SHEET = "DemoHistory"
+DEMO_PRODUCTS_SHEET = "DemoProducts"
+DEMO_PRODUCT_COLUMNS = ["Demo ID", "Employee Code", "Outlet Name", "Demo Date", "Product Name", "Quantity"]
+DEMO_CONVERSION_WINDOW_DAYS = 30
 TICKET_CATEGORIES = [
     "HR Department",
     "MIS & Back Office",
@@ -383,6 +768,227 @@ PRIORITY_LEVELS = ["Low", "Medium", "High", "Critical"]
 TRAVEL_MODES = ["Bus", "Train", "Flight", "Taxi", "Other"]
 REQUEST_TYPES = ["Hotel", "Travel", "Travel & Hotel"]
 
+class HistoryQuery:
+    """Indexed view over a history frame: typed dates, a sorted date index and hash indexes on key columns"""
+
+    def __init__(self, data, date_column, key_columns):
+        data = data.reset_index(drop=True).copy()
+        if not pd.api.types.is_datetime64_any_dtype(data[date_column]):
+            data[date_column] = pd.to_datetime(data[date_column], dayfirst=True, errors='coerce')
+        self.data = data
+        self.date_column = date_column
+
+        days = data[date_column].values.astype('datetime64[D]')
+        valid = np.flatnonzero(~np.isnat(days))
+        order = valid[np.argsort(days[valid], kind='stable')]
+        self._date_order = order
+        self._sorted_days = days[order]
+
+        self._hash_index = {}
+        self._search_blob = {}
+        for column in key_columns:
+            keys = data[column].fillna("").astype(str).str.strip().str.lower()
+            self._hash_index[column] = {key: positions for key, positions in keys.groupby(keys, sort=False).indices.items()}
+            unique_keys = list(self._hash_index[column])
+            starts = list(itertools.accumulate([0] + [len(key) + 1 for key in unique_keys[:-1]])) if unique_keys else []
+            self._search_blob[column] = ("\n".join(unique_keys), starts, unique_keys)
+
+    def __len__(self):
+        return len(self.data)
+
+    def lookup(self, column, value):
+        """Positions whose key column equals value (case-insensitive)"""
+        return self._hash_index[column].get(str(value).strip().lower(), np.array([], dtype=int))
+
+    def containing(self, column, text):
+        """Positions whose key column contains text (case-insensitive)"""
+        needle = str(text).strip().lower()
+        blob, starts, unique_keys = self._search_blob[column]
+        if not needle or "\n" in needle:
+            return np.array([], dtype=int)
+        matched = set()
+        position = blob.find(needle)
+        while position != -1:
+            key_number = bisect.bisect_right(starts, position) - 1
+            matched.add(key_number)
+            # Skip to the next key so each key is matched once
+            next_start = starts[key_number + 1] if key_number + 1 < len(starts) else len(blob)
+            position = blob.find(needle, max(position + 1, next_start))
+        if not matched:
+            return np.array([], dtype=int)
+        index = self._hash_index[column]
+        return np.concatenate([index[unique_keys[k]] for k in matched])
+
+    def between(self, start, end):
+        """Positions whose date falls within [start, end]"""
+        left = np.searchsorted(self._sorted_days, np.datetime64(start, 'D'), side='left')
+        right = np.searchsorted(self._sorted_days, np.datetime64(end, 'D'), side='right')
+        return self._date_order[left:right]
+
+    def filter(self, date=None, date_range=None, contains=None, equals=None):
+        """Rows matching every given condition, in their original order"""
+        selections = []
+        if date:
+            selections.append(self.between(date, date))
+        if date_range:
+            selections.append(self.between(*date_range))
+        for column, text in (contains or {}).items():
+            if text:
+                selections.append(self.containing(column, text))
+        for column, value in (equals or {}).items():
+            if value:
+                selections.append(self.lookup(column, value))
+        if not selections:
+            return self.data
+        positions = selections[0]
+        for selection in selections[1:]:
+            positions = np.intersect1d(positions, selection)
+        return self.data.iloc[np.sort(positions)]
+
+TEXT_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def tokenize_text(text):
+    return TEXT_TOKEN_PATTERN.findall(str(text).lower())
+
+class TextSearchIndex:
+    """Inverted index with BM25 ranking over the free-text columns of a history sheet"""
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.postings = defaultdict(dict)
+        self.doc_lengths = {}
+        self.total_length = 0
+        self.next_row = 0
+        self._vocabulary = None
+
+    def add_rows(self, data):
+        """Index rows whose sheet position is at or after the last indexed row"""
+        new_rows = data[data.index >= self.next_row]
+        if new_rows.empty:
+            return 0
+        columns = [c for c in self.columns if c in new_rows.columns]
+        texts = new_rows[columns].fillna("").astype(str).agg(" ".join, axis=1)
+        for row_id, text in texts.items():
+            tokens = tokenize_text(text)
+            self.doc_lengths[row_id] = len(tokens)
+            self.total_length += len(tokens)
+            for token in tokens:
+                postings = self.postings[token]
+                postings[row_id] = postings.get(row_id, 0) + 1
+        self.next_row = int(new_rows.index.max()) + 1
+        self._vocabulary = None
+        return len(new_rows)
+
+    def _expand(self, token):
+        """Exact token plus vocabulary words it prefixes, so partial words still match"""
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        start = bisect.bisect_left(self._vocabulary, token)
+        matches = []
+        for word in itertools.islice(self._vocabulary, start, None):
+            if not word.startswith(token):
+                break
+            matches.append(word)
+        return matches
+
+    def search(self, query, allowed_rows=None, limit=20):
+        """Return (row_id, score) pairs ranked by BM25, optionally restricted to allowed_rows"""
+        tokens = tokenize_text(query)
+        if not tokens or not self.doc_lengths:
+            return []
+        doc_count = len(self.doc_lengths)
+        average_length = self.total_length / doc_count or 1
+        scores = defaultdict(float)
+        for position, token in enumerate(tokens):
+            words = self._expand(token) if position == len(tokens) - 1 else [token]
+            for word in words:
+                postings = self.postings.get(word)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for row_id, frequency in postings.items():
+                    if allowed_rows is not None and row_id not in allowed_rows:
+                        continue
+                    length_norm = 1 - self.b + self.b * self.doc_lengths[row_id] / average_length
+                    scores[row_id] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+HISTORY_CACHE_TTL = 300
+
+class HistoryStore:
+    """Shared snapshot of one history sheet, read once per refresh interval and partitioned by employee"""
+
+    def __init__(self, sheet, employee_column, prepare, read=None, text_columns=None):
+        self.sheet = sheet
+        self.employee_column = employee_column
+        self.prepare = prepare
+        self.read = read or (lambda: conn.read(worksheet=sheet, ttl=5))
+        self.text_columns = text_columns
+        self.text_index = None
+        self.data = pd.DataFrame()
+        self.partitions = {}
+        self.loaded_at = 0
+        self.version = 0
+        self._queries = {}
+        self._lock = threading.Lock()
+
+    def is_stale(self):
+        return time.time() - self.loaded_at > HISTORY_CACHE_TTL
+
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and not self.is_stale():
+                return
+            data = self.read().dropna(how='all')
+            data = self.prepare(data) if not data.empty else data
+            self.data = data
+            self.partitions = dict(tuple(data.groupby(self.employee_column, sort=False))) if not data.empty else {}
+            self._queries = {}
+            if self.text_columns:
+                # Sheets are append-only, so only rows past the last indexed one need indexing
+                if self.text_index is None or len(data) < len(self.text_index.doc_lengths):
+                    self.text_index = TextSearchIndex(self.text_columns)
+                self.text_index.add_rows(data)
+            self.loaded_at = time.time()
+            self.version += 1
+
+    def invalidate(self):
+        self.loaded_at = 0
+
+    def snapshot(self):
+        """All rows across employees"""
+        self.refresh()
+        return self.data
+
+    def for_employee(self, employee_code):
+        self.refresh()
+        partition = self.partitions.get(employee_code)
+        if partition is None:
+            return self.data.iloc[0:0]
+        return partition
+
+    def query(self, employee_code, date_column, key_columns):
+        """HistoryQuery over one employee's partition, rebuilt only when the snapshot changes"""
+        self.refresh()
+        cache_key = (employee_code, date_column, tuple(key_columns))
+        if cache_key not in self._queries:
+            self._queries[cache_key] = HistoryQuery(self.for_employee(employee_code), date_column, key_columns)
+        return self._queries[cache_key]
+
+    def search(self, employee_code, text, limit=20):
+        """Ranked full-text hits within one employee's rows, with a Score column"""
+        partition = self.for_employee(employee_code)
+        if self.text_index is None or partition.empty:
+            return partition.iloc[0:0]
+        hits = self.text_index.search(text, allowed_rows=set(partition.index), limit=limit)
+        if not hits:
+            return partition.iloc[0:0]
+        row_ids, scores = zip(*hits)
+        return partition.loc[list(row_ids)].assign(Score=[round(score, 2) for score in scores])
+
 conn = st.connection("gsheets", type=GSheetsConnection)
 
 Products = pd.read_csv('Invoice - Products.csv')
@@ -390,6 +996,111 @@ Outlet = pd.read_csv('Invoice - Outlet.csv')
 Person = pd.read_csv('Invoice - Person.csv')
 Distributors = pd.read_csv('Invoice - Distributors.csv')
 
+GEOFENCE_OFFICES_FILE = os.environ.get("GEOFENCE_OFFICES_FILE", "Geofence - Offices.csv")
+GEOFENCE_OUTLETS_FILE = os.environ.get("GEOFENCE_OUTLETS_FILE", "Geofence - Outlets.csv")
+GEOFENCE_OFFICE_RADIUS_M = 200
+GEOFENCE_OUTLET_RADIUS_M = 100
+GEOFENCE_CELL_DEG = 0.01
+GEOFENCE_MAX_RINGS = 5
+METRES_PER_DEGREE = 111320
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in metres; accepts scalars or NumPy arrays"""
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+def load_geofence_locations():
+    """Offices and outlets with coordinates from the local geofence files; missing files are skipped"""
+    frames = []
+    for path, name_column, location_type, default_radius in [
+        (GEOFENCE_OFFICES_FILE, "Office Name", "HQ", GEOFENCE_OFFICE_RADIUS_M),
+        (GEOFENCE_OUTLETS_FILE, "Shop Name", "Outlet", GEOFENCE_OUTLET_RADIUS_M)
+    ]:
+        if not os.path.exists(path):
+            continue
+        data = pd.read_csv(path)
+        frames.append(pd.DataFrame({
+            "Name": data[name_column].astype(str),
+            "Type": location_type,
+            "Latitude": pd.to_numeric(data["Latitude"], errors='coerce'),
+            "Longitude": pd.to_numeric(data["Longitude"], errors='coerce'),
+            "Radius": pd.to_numeric(data.get("Radius (m)"), errors='coerce') if "Radius (m)" in data else np.nan
+        }).fillna({"Radius": default_radius}))
+    if not frames:
+        return pd.DataFrame(columns=["Name", "Type", "Latitude", "Longitude", "Radius"])
+    locations = pd.concat(frames, ignore_index=True)
+    return locations.dropna(subset=["Latitude", "Longitude"]).reset_index(drop=True)
+
+class GeofenceIndex:
+    """Uniform lat/lng grid over known offices and outlets for nearest-location lookups"""
+
+    def __init__(self, locations, cell_deg=GEOFENCE_CELL_DEG):
+        self.locations = locations
+        self.cell_deg = cell_deg
+        self.lat = locations["Latitude"].to_numpy(dtype=float)
+        self.lng = locations["Longitude"].to_numpy(dtype=float)
+        self.names = locations["Name"].tolist()
+        self.types = locations["Type"].tolist()
+        self.radii = locations["Radius"].to_numpy(dtype=float)
+        self.cells = defaultdict(list)
+        for position, cell in enumerate(zip((self.lat // cell_deg).astype(int), (self.lng // cell_deg).astype(int))):
+            self.cells[cell].append(position)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def _ring(self, row, col, radius):
+        for i in range(row - radius, row + radius + 1):
+            for j in range(col - radius, col + radius + 1):
+                if max(abs(i - row), abs(j - col)) == radius:
+                    yield from self.cells.get((i, j), ())
+
+    def nearest(self, lat, lng):
+        """Position of the closest location and its distance in metres"""
+        row, col = int(lat // self.cell_deg), int(lng // self.cell_deg)
+        best, best_distance = None, np.inf
+        for radius in range(GEOFENCE_MAX_RINGS + 1):
+            # Unvisited cells are at least radius - 1 whole cells away from the query point
+            if best is not None and best_distance <= (radius - 1) * self.cell_deg * METRES_PER_DEGREE * math.cos(math.radians(lat)):
+                break
+            candidates = list(self._ring(row, col, radius))
+            if candidates:
+                distances = haversine_m(lat, lng, self.lat[candidates], self.lng[candidates])
+                index = int(np.argmin(distances))
+                if distances[index] < best_distance:
+                    best, best_distance = candidates[index], float(distances[index])
+        else:
+            distances = haversine_m(lat, lng, self.lat, self.lng)
+            best = int(np.argmin(distances))
+            best_distance = float(distances[best])
+        return best, best_distance
+
+    def classify(self, lat, lng):
+        """(status, nearest location name, distance in metres) for a check-in"""
+        if not len(self):
+            return "Unverified", "", None
+        position, distance = self.nearest(lat, lng)
+        if distance <= self.radii[position]:
+            status = "At HQ" if self.types[position] == "HQ" else "At Outlet"
+        else:
+            status = "Off-site"
+        return status, self.names[position], round(distance)
+
+def geofence_files_signature():
+    """Modification times of the geofence files, so edits and newly added files are picked up"""
+    return tuple(
+        os.path.getmtime(path) if os.path.exists(path) else None
+        for path in (GEOFENCE_OFFICES_FILE, GEOFENCE_OUTLETS_FILE)
+    )
+
+@st.cache_resource(max_entries=2)
+def _load_geofence_index(signature):
+    return GeofenceIndex(load_geofence_locations())
+
+def get_geofence_index():
+    return _load_geofence_index(geofence_files_signature())
+
 company_name = "BIOLUME SKIN SCIENCE PRIVATE LIMITED"
 company_address = """Ground Floor Rampal Awana Complex,
 Rampal Awana Complex, Indra Market,
@@ -405,16 +1116,51 @@ Prices, taxes, and availability are subject to change. Final billing may vary.
 Goods/services will be delivered only after confirmation and payment. No legal obligation is created by this document.
 """
 
+INVOICE_ARCHIVE_ENABLED = os.environ.get("INVOICE_ARCHIVE", "true").lower() == "true"
+INVOICE_PDF_MODE = os.environ.get("INVOICE_PDF_MODE", "compact").lower()
+INVOICE_LOGO_WIDTH_PX = 400
+INVOICE_CACHE_DIR = ".invoice_cache"
+
 os.makedirs("employee_selfies", exist_ok=True)
 os.makedirs("payment_receipts", exist_ok=True)
-os.makedirs("invoices", exist_ok=True)
+if INVOICE_ARCHIVE_ENABLED:
+    os.makedirs("invoices", exist_ok=True)
 os.makedirs("visit_selfies", exist_ok=True)
 
+@st.cache_resource
+def prepare_compact_logo(logo_path, width_px):
+    """Downsample the logo and flatten its alpha channel once, returning the cached file path"""
+    try:
+        os.makedirs(INVOICE_CACHE_DIR, exist_ok=True)
+        stem = os.path.splitext(os.path.basename(logo_path))[0].replace(" ", "_")
+        cached_path = os.path.join(INVOICE_CACHE_DIR, f"{stem}_{width_px}_{int(os.path.getmtime(logo_path))}.png")
+        if os.path.exists(cached_path):
+            return cached_path
+        
+        logo = Image.open(logo_path)
+        if logo.width > width_px:
+            logo = logo.resize((width_px, round(logo.height * width_px / logo.width)), Image.LANCZOS)
+        if logo.mode in ("RGBA", "LA", "P"):
+            logo = logo.convert("RGBA")
+            background = Image.new("RGB", logo.size, (255, 255, 255))
+            background.paste(logo, mask=logo.split()[-1])
+            logo = background
+        logo.save(cached_path, optimize=True)
+        return cached_path
+    except Exception:
+        logger.warning("Could not prepare compact logo from %s, using the original", logo_path, exc_info=True)
+        return logo_path
+
+def invoice_logo_path():
+    if INVOICE_PDF_MODE == "compact":
+        return prepare_compact_logo(company_logo, INVOICE_LOGO_WIDTH_PX)
+    return company_logo
+
 class PDF(FPDF):
     def header(self):
         if company_logo:
             try:
-                self.image(company_logo, 10, 8, 33)
+                self.image(invoice_logo_path(), 10, 8, 33)
             except:
                 pass
         
@@ -428,6 +1174,27 @@ class PDF(FPDF):
         self.line(10, 50, 200, 50)
         self.ln(1)
 
+def pdf_to_bytes(pdf):
+    """Render an FPDF document to bytes in memory"""
+    output = pdf.output(dest='S')
+    if isinstance(output, str):
+        return output.encode('latin-1')
+    return bytes(output)
+
+def _write_invoice_pdf(pdf_path, pdf_bytes):
+    try:
+        with open(pdf_path, "wb") as f:
+            f.write(pdf_bytes)
+    except Exception:
+        # Runs on a background thread after the download is served, so there is no page to report to
+        logger.exception("Failed to archive invoice %s", pdf_path)
+
+def archive_invoice_pdf(pdf_path, pdf_bytes):
+    """Persist a rendered invoice to disk in the background when archival is enabled"""
+    if not INVOICE_ARCHIVE_ENABLED:
+        return
+    threading.Thread(target=_write_invoice_pdf, args=(pdf_path, pdf_bytes), daemon=True).start()
+
 def generate_invoice_number():
     return f"INV-{get_ist_time().strftime('%Y%m%d')}-{str(uuid.uuid4())[:8].upper()}"
 
@@ -452,21 +1219,419 @@ def save_uploaded_file(uploaded_file, folder):
         return file_path
     return None
 
+def _sales_line_keys(df):
+    return pd.MultiIndex.from_arrays([df['Invoice Number'].astype(str), df['Product Name'].astype(str)])
+
+def write_sales_rows(conn, sales_data):
+    """Write Sales rows plus the summary and rollups derived from them; raises if the Sales write fails"""
+    existing_sales_data = conn.read(worksheet="Sales", ttl=5)
+    existing_sales_data = existing_sales_data.dropna(how='all')
+    
+    sales_data = sales_data.reindex(columns=SALES_SHEET_COLUMNS)
+    replaced_sales_data = existing_sales_data.reindex(columns=SALES_SHEET_COLUMNS)
+    replaced_sales_data = replaced_sales_data[_sales_line_keys(replaced_sales_data).isin(_sales_line_keys(sales_data))]
+    
+    updated_sales_data = pd.concat([existing_sales_data, sales_data], ignore_index=True)
+    updated_sales_data = updated_sales_data.drop_duplicates(subset=["Invoice Number", "Product Name"], keep="last")
+    
+    conn.update(worksheet="Sales", data=updated_sales_data)
+    get_history_store(SALES_HISTORY_SHEET).invalidate()
+    get_history_store(INVOICE_SUMMARY_SHEET).invalidate()
+    
+    warnings = []
+    success, error = upsert_invoice_summary(conn, summarize_invoice_lines(sales_data))
+    if not success:
+        warnings.append(f"Sale saved, but the invoice summary could not be updated: {error}")
+    
+    success, error = update_sales_rollups(conn, updated_sales_data, pd.concat([sales_data, replaced_sales_data], ignore_index=True))
+    if not success:
+        warnings.append(f"Sale saved, but the dashboard rollups could not be updated: {error}")
+    return warnings
+
 def log_sales_to_gsheet(conn, sales_data):
     try:
-        existing_sales_data = conn.read(worksheet="Sales", ttl=5)
-        existing_sales_data = existing_sales_data.dropna(how='all')
+        warnings = write_sales_rows(conn, sales_data)
+    except Exception as e:
+        queue_failed_submission("sales", sales_data, sales_data['Employee Code'].iloc[0], e)
+        return
+    st.success("Sales data successfully logged to Google Sheets!")
+    for warning in warnings:
+        st.warning(warning)
+
+def summarize_invoice_lines(lines):
+    """Collapse Sales line items into one summary row per invoice"""
+    lines = lines.copy()
+    lines['Invoice Number'] = lines['Invoice Number'].astype(str)
+    lines['Grand Total'] = pd.to_numeric(lines['Grand Total'], errors='coerce')
+    if pd.api.types.is_datetime64_any_dtype(lines['Invoice Date']):
+        lines['Invoice Date'] = lines['Invoice Date'].dt.strftime("%d-%m-%Y")
+    
+    summary = lines.groupby('Invoice Number', sort=False).agg(**{
+        'Invoice Date': ('Invoice Date', 'first'),
+        'Employee Name': ('Employee Name', 'first'),
+        'Employee Code': ('Employee Code', 'first'),
+        'Outlet Name': ('Outlet Name', 'first'),
+        'Grand Total': ('Grand Total', 'sum'),
+        'Payment Status': ('Payment Status', 'first'),
+        'Delivery Status': ('Delivery Status', 'first'),
+        'Line Items': ('Invoice Number', 'size')
+    }).reset_index()
+    return summary.reindex(columns=INVOICE_SUMMARY_COLUMNS)
+
+def upsert_invoice_summary(conn, summary_rows):
+    try:
+        existing_data = read_sheet_or_empty(conn, INVOICE_SUMMARY_SHEET, INVOICE_SUMMARY_COLUMNS)
+        existing_data['Invoice Number'] = existing_data['Invoice Number'].astype(str)
         
-        sales_data = sales_data.reindex(columns=SALES_SHEET_COLUMNS)
+        updated_data = pd.concat([existing_data, summary_rows], ignore_index=True)
+        updated_data = updated_data.drop_duplicates(subset=["Invoice Number"], keep="last")
         
-        updated_sales_data = pd.concat([existing_sales_data, sales_data], ignore_index=True)
-        updated_sales_data = updated_sales_data.drop_duplicates(subset=["Invoice Number", "Product Name"], keep="last")
+        replace_sheet(conn, INVOICE_SUMMARY_SHEET, updated_data)
+        return True, None
+    except Exception as e:
+        return False, str(e)
+
+def update_invoice_summary_status(conn, invoice_number, new_status):
+    try:
+        summary_data = read_sheet_or_empty(conn, INVOICE_SUMMARY_SHEET, INVOICE_SUMMARY_COLUMNS)
         
-        conn.update(worksheet="Sales", data=updated_sales_data)
-        st.success("Sales data successfully logged to Google Sheets!")
+        mask = summary_data['Invoice Number'].astype(str) == str(invoice_number)
+        summary_data.loc[mask, 'Delivery Status'] = new_status
+        
+        replace_sheet(conn, INVOICE_SUMMARY_SHEET, summary_data)
+        return True, None
     except Exception as e:
-        st.error(f"Error logging sales data: {e}")
-        st.stop()
+        return False, str(e)
+
+def read_history_source(conn, sheet, columns=None):
+    """Full read of a source history sheet, for rebuilding and reconciling the sheets derived from it"""
+    data = conn.read(worksheet=sheet, usecols=list(range(len(columns))) if columns else None, ttl=5)
+    return data.dropna(how='all')
+
+def rebuild_invoice_summary(conn, sales_data=None):
+    """Backfill the invoice summary sheet from the full Sales history"""
+    if sales_data is None:
+        sales_data = read_history_source(conn, SALES_HISTORY_SHEET)
+    summary = summarize_invoice_lines(sales_data) if not sales_data.empty else pd.DataFrame(columns=INVOICE_SUMMARY_COLUMNS)
+    replace_sheet(conn, INVOICE_SUMMARY_SHEET, summary)
+    return summary
+
+def invoice_summary_lags(conn, sales_data):
+    """Whether SalesHistory has invoices the summary does not, e.g. ones written before the summary existed or by Distributor.py"""
+    if sales_data.empty:
+        return False
+    summary = read_sheet_or_empty(conn, INVOICE_SUMMARY_SHEET, INVOICE_SUMMARY_COLUMNS)
+    sales_invoices = set(sales_data['Invoice Number'].dropna().astype(str))
+    return not sales_invoices.issubset(summary['Invoice Number'].astype(str))
+
+def read_invoice_summary():
+    return read_sheet_or_empty(conn, INVOICE_SUMMARY_SHEET, INVOICE_SUMMARY_COLUMNS)
+
+def prepare_invoice_summary(summary):
+    summary = summary.copy()
+    summary['Invoice Number'] = summary['Invoice Number'].astype(str)
+    summary['Outlet Name'] = summary['Outlet Name'].astype(str)
+    summary['Invoice Date'] = pd.to_datetime(summary['Invoice Date'], dayfirst=True, errors='coerce')
+    summary['Grand Total'] = pd.to_numeric(summary['Grand Total'], errors='coerce')
+    summary = summary[summary['Invoice Date'].notna()]
+    return summary.sort_values('Invoice Date', ascending=False)
+
+def prepare_sales_history(sales_data):
+    sales_data = sales_data.copy()
+    sales_data['Outlet Name'] = sales_data['Outlet Name'].astype(str)
+    sales_data['Invoice Number'] = sales_data['Invoice Number'].astype(str)
+    
+    try:
+        sales_data['Invoice Date'] = pd.to_datetime(sales_data['Invoice Date'], dayfirst=True, errors='coerce')
+    except:
+        sales_data['Invoice Date'] = pd.to_datetime(sales_data['Invoice Date'], errors='coerce')
+    
+    numeric_cols = ['Grand Total', 'Unit Price', 'Total Price', 'Product Discount (%)', 'Quantity']
+    for col in numeric_cols:
+        if col in sales_data.columns:
+            sales_data[col] = pd.to_numeric(sales_data[col], errors='coerce')
+    
+    return sales_data[sales_data['Invoice Date'].notna()]
+
+def prepare_demo_history(df):
+    df = df.copy()
+    df['Demo Date'] = pd.to_datetime(df['Demo Date'], dayfirst=True, errors='coerce')
+    df['Duration (minutes)'] = pd.to_numeric(df['Duration (minutes)'], errors='coerce')
+    return df.sort_values('Demo Date', ascending=False)
+
+def demo_products_lag(conn, demos):
+    """Whether DemoHistory has demos with products that the DemoProducts sheet does not"""
+    if demos.empty:
+        return False
+    demo_products = read_sheet_or_empty(conn, DEMO_PRODUCTS_SHEET, DEMO_PRODUCT_COLUMNS)
+    demo_ids = demos.loc[demos['Products'].fillna("").astype(str).str.strip() != "", 'Demo ID'].astype(str)
+    return not set(demo_ids).issubset(demo_products['Demo ID'].astype(str))
+
+def read_demo_products():
+    return read_sheet_or_empty(conn, DEMO_PRODUCTS_SHEET, DEMO_PRODUCT_COLUMNS)
+
+def prepare_demo_products(df):
+    df = df.copy()
+    df['Demo ID'] = df['Demo ID'].astype(str)
+    df['Demo Date'] = pd.to_datetime(df['Demo Date'], dayfirst=True, errors='coerce')
+    df['Quantity'] = pd.to_numeric(df['Quantity'], errors='coerce').fillna(0).astype(int)
+    return df
+
+def prepare_visit_history(df):
+    df = df.copy()
+    df['Visit ID'] = df['Visit ID'].astype(str)
+    df['Visit Date'] = pd.to_datetime(df['Visit Date'], dayfirst=True, errors='coerce')
+    return df.sort_values('Visit Date', ascending=False, kind='stable')
+
+def prepare_ticket_history(df):
+    return df.sort_values(by="Date Raised", ascending=False)
+
+def prepare_travel_history(df):
+    return df.sort_values(by="Date Requested", ascending=False)
+
+HISTORY_SOURCES = {
+    SALES_HISTORY_SHEET: ("Employee Code", prepare_sales_history, None),
+    INVOICE_SUMMARY_SHEET: ("Employee Code", prepare_invoice_summary, read_invoice_summary),
+    DEMO_HISTORY_SHEET: ("Employee Code", prepare_demo_history, None),
+    DEMO_PRODUCTS_SHEET: ("Employee Code", prepare_demo_products, read_demo_products),
+    VISIT_HISTORY_SHEET: ("Employee Code", prepare_visit_history, None),
+    TICKET_HISTORY_SHEET: (
+        "Raised By (Employee Code)",
+        prepare_ticket_history,
+        lambda: conn.read(worksheet=TICKET_HISTORY_SHEET, usecols=list(range(len(TICKET_SHEET_COLUMNS))), ttl=5)
+    ),
+    TRAVEL_HISTORY_SHEET: (
+        "Employee Code",
+        prepare_travel_history,
+        lambda: conn.read(worksheet=TRAVEL_HISTORY_SHEET, usecols=list(range(len(TRAVEL_HOTEL_COLUMNS))), ttl=5)
+    )
+}
+
+TEXT_SEARCH_COLUMNS = {
+    VISIT_HISTORY_SHEET: ["Visit Notes", "Remarks"],
+    DEMO_HISTORY_SHEET: ["Remarks"],
+    TICKET_HISTORY_SHEET: ["Subject", "Details"]
+}
+
+@st.cache_resource
+def get_history_store(sheet):
+    """Process-wide store for a history sheet, shared by every session"""
+    employee_column, prepare, read = HISTORY_SOURCES[sheet]
+    return HistoryStore(sheet, employee_column, prepare, read, TEXT_SEARCH_COLUMNS.get(sheet))
+
+SQL_CONSOLE_TABLES = {
+    "sales": SALES_HISTORY_SHEET,
+    "invoices": INVOICE_SUMMARY_SHEET,
+    "demos": DEMO_HISTORY_SHEET,
+    "demo_products": DEMO_PRODUCTS_SHEET,
+    "visits": VISIT_HISTORY_SHEET,
+    "tickets": TICKET_HISTORY_SHEET,
+    "travel": TRAVEL_HISTORY_SHEET
+}
+SQL_CONSOLE_ROW_LIMIT = 10000
+SAVED_QUERIES_FILE = os.environ.get("SAVED_QUERIES_FILE", "saved_queries.json")
+DEFAULT_SAVED_QUERIES = {
+    "Repeat orders per outlet": """SELECT
+    "Outlet Name",
+    COUNT(DISTINCT "Invoice Number") AS invoices,
+    MIN("Invoice Date") AS first_order,
+    MAX("Invoice Date") AS last_order,
+    COUNT(DISTINCT "Invoice Number") > 1 AS repeat_customer
+FROM sales
+GROUP BY 1
+ORDER BY invoices DESC""",
+    "Repeat-order rate": """WITH orders AS (
+    SELECT "Outlet Name", COUNT(DISTINCT "Invoice Number") AS invoices
+    FROM sales
+    GROUP BY 1
+)
+SELECT
+    COUNT(*) AS outlets,
+    COUNT(*) FILTER (WHERE invoices > 1) AS repeat_outlets,
+    ROUND(100.0 * COUNT(*) FILTER (WHERE invoices > 1) / COUNT(*), 1) AS repeat_rate_pct
+FROM orders""",
+    "Discount distribution by category": """SELECT
+    "Product Category",
+    "Product Discount (%)" AS discount_pct,
+    COUNT(*) AS line_items,
+    SUM("Quantity") AS units,
+    ROUND(SUM("Total Price"), 2) AS value
+FROM sales
+GROUP BY ALL
+ORDER BY 1, 2"""
+}
+
+class AnalyticsEngine:
+    """In-process DuckDB database over the history store snapshots, with file access disabled"""
+
+    def __init__(self):
+        self.db = duckdb.connect(database=":memory:", config={
+            "enable_external_access": False,
+            "lock_configuration": True
+        })
+        self.versions = {}
+        self._lock = threading.Lock()
+
+    def _sync_tables(self):
+        for table, sheet in SQL_CONSOLE_TABLES.items():
+            store = get_history_store(sheet)
+            data = store.snapshot()
+            if self.versions.get(table) != store.version:
+                # A sheet that has never been written has no columns to register
+                if len(data.columns):
+                    self.db.register(table, data)
+                else:
+                    self.db.unregister(table)
+                self.versions[table] = store.version
+
+    def run(self, sql, limit=SQL_CONSOLE_ROW_LIMIT):
+        """Run a single read-only query and return (result, error)"""
+        try:
+            statements = duckdb.extract_statements(sql)
+        except duckdb.Error as e:
+            return None, str(e)
+        if len(statements) != 1:
+            return None, "Enter exactly one statement."
+        if statements[0].type != duckdb.StatementType.SELECT:
+            return None, "Only SELECT / WITH queries are allowed."
+        try:
+            with self._lock:
+                self._sync_tables()
+                return self.db.sql(sql).limit(limit).df(), None
+        except duckdb.Error as e:
+            return None, str(e)
+
+@st.cache_resource
+def get_analytics_engine():
+    return AnalyticsEngine()
+
+def load_saved_queries():
+    queries = dict(DEFAULT_SAVED_QUERIES)
+    try:
+        with open(SAVED_QUERIES_FILE) as f:
+            queries.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        st.warning(f"Could not read saved queries: {e}")
+    return queries
+
+def save_query(name, sql):
+    try:
+        try:
+            with open(SAVED_QUERIES_FILE) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            saved = {}
+        saved[name] = sql
+        with open(SAVED_QUERIES_FILE, "w") as f:
+            json.dump(saved, f, indent=2)
+        return True, None
+    except Exception as e:
+        return False, str(e)
+
+def render_text_search(sheet, employee_code, key, display_columns, label):
+    query = st.text_input(label, key=key, placeholder="Type words to search, e.g. 'pending payment'")
+    if not query:
+        return
+    try:
+        hits = get_history_store(sheet).search(employee_code, query)
+    except Exception as e:
+        st.error(f"Search failed: {e}")
+        return
+    if hits.empty:
+        st.info("No matching notes found")
+        return
+    st.caption(f"Top {len(hits)} matches")
+    st.dataframe(hits[display_columns + ['Score']], use_container_width=True, hide_index=True)
+
+SALES_ROLLUP_SHEET = "SalesRollups"
+SALES_ROLLUP_COLUMNS = ["Date", "Dimension", "Key", "Grand Total", "Quantity", "Line Items"]
+SALES_ROLLUP_DIMENSIONS = {
+    "Employee": "Employee Name",
+    "Zone": "Zone",
+    "Product Category": "Product Category",
+    "Distributor": "Distributor Firm Name"
+}
+
+EMPLOYEE_ZONES = (
+    Person.drop_duplicates(subset="Employee Code")
+    .set_index("Employee Code")["Zone"]
+    .fillna("Unassigned").astype(str).str.strip().str.upper()
+)
+
+def _rollup_dates(lines):
+    return pd.to_datetime(lines['Invoice Date'], dayfirst=True, errors='coerce').dt.strftime("%Y-%m-%d")
+
+def compute_sales_rollups(lines):
+    """Aggregate Sales line items into daily totals for every dashboard dimension"""
+    if lines.empty:
+        return pd.DataFrame(columns=SALES_ROLLUP_COLUMNS)
+    lines = lines.assign(
+        Date=_rollup_dates(lines),
+        Zone=lines['Employee Code'].map(EMPLOYEE_ZONES).fillna("Unassigned"),
+        **{
+            'Grand Total': pd.to_numeric(lines['Grand Total'], errors='coerce').fillna(0),
+            'Quantity': pd.to_numeric(lines['Quantity'], errors='coerce').fillna(0),
+            'Line Items': 1
+        }
+    )
+    lines = lines[lines['Date'].notna()]
+    frames = []
+    for dimension, column in SALES_ROLLUP_DIMENSIONS.items():
+        keys = lines[column].fillna("").astype(str).str.strip().replace("", "None")
+        grouped = lines.groupby([lines['Date'], keys.rename('Key')])[['Grand Total', 'Quantity', 'Line Items']].sum().reset_index()
+        frames.append(grouped.assign(Dimension=dimension))
+    return pd.concat(frames, ignore_index=True).reindex(columns=SALES_ROLLUP_COLUMNS)
+
+def merge_sales_rollups(existing, delta):
+    combined = pd.concat([existing, delta], ignore_index=True)
+    for col in ['Grand Total', 'Quantity', 'Line Items']:
+        combined[col] = pd.to_numeric(combined[col], errors='coerce').fillna(0)
+    merged = combined.groupby(['Date', 'Dimension', 'Key'], as_index=False)[['Grand Total', 'Quantity', 'Line Items']].sum()
+    merged = merged[merged['Line Items'] != 0]
+    return merged.reindex(columns=SALES_ROLLUP_COLUMNS)
+
+def update_sales_rollups(conn, all_lines, changed_lines):
+    """Recompute the rollup days that changed_lines fall on from all_lines, so replaying a write leaves them unchanged"""
+    try:
+        existing_data = read_sheet_or_empty(conn, SALES_ROLLUP_SHEET, SALES_ROLLUP_COLUMNS)
+        
+        dates = set(_rollup_dates(changed_lines).dropna())
+        kept_data = existing_data[~existing_data['Date'].astype(str).isin(dates)]
+        recomputed = compute_sales_rollups(all_lines[_rollup_dates(all_lines).isin(dates)])
+        updated_data = merge_sales_rollups(kept_data, recomputed)
+        
+        replace_sheet(conn, SALES_ROLLUP_SHEET, updated_data)
+        return True, None
+    except Exception as e:
+        return False, str(e)
+
+def rebuild_sales_rollups(conn, sales_data=None):
+    """Backfill the rollup sheet from the full Sales history"""
+    if sales_data is None:
+        sales_data = read_history_source(conn, SALES_HISTORY_SHEET)
+    rollups = merge_sales_rollups(pd.DataFrame(columns=SALES_ROLLUP_COLUMNS), compute_sales_rollups(sales_data))
+    replace_sheet(conn, SALES_ROLLUP_SHEET, rollups)
+    return rollups
+
+def sales_rollups_lag(conn, sales_data):
+    """Whether SalesHistory has more line items on some day than the rollups count for it"""
+    if sales_data.empty:
+        return False
+    rollups = read_sheet_or_empty(conn, SALES_ROLLUP_SHEET, SALES_ROLLUP_COLUMNS)
+    history_lines = sales_data.groupby(_rollup_dates(sales_data)).size()
+    employee_rollups = rollups[rollups['Dimension'] == "Employee"]
+    rollup_lines = pd.to_numeric(employee_rollups['Line Items'], errors='coerce').groupby(employee_rollups['Date'].astype(str)).sum()
+    return bool((history_lines > rollup_lines.reindex(history_lines.index, fill_value=0)).any())
+
+@st.cache_data(ttl=300)
+def load_sales_rollups():
+    rollups = read_sheet_or_empty(conn, SALES_ROLLUP_SHEET, SALES_ROLLUP_COLUMNS)
+    rollups['Date'] = pd.to_datetime(rollups['Date'], errors='coerce')
+    for col in ['Grand Total', 'Quantity', 'Line Items']:
+        rollups[col] = pd.to_numeric(rollups[col], errors='coerce').fillna(0)
+    return rollups[rollups['Date'].notna()]
 
 def update_delivery_status(conn, invoice_number, product_name, new_status):
     try:
@@ -482,37 +1647,199 @@ def update_delivery_status(conn, invoice_number, product_name, new_status):
         st.error(f"Error updating delivery status: {e}")
         return False
 
+def write_visit_rows(conn, visit_data):
+    existing_visit_data = conn.read(worksheet="Visits", ttl=5)
+    existing_visit_data = existing_visit_data.dropna(how='all')
+    
+    visit_data = visit_data.reindex(columns=VISIT_SHEET_COLUMNS)
+    
+    updated_visit_data = pd.concat([existing_visit_data, visit_data], ignore_index=True)
+    updated_visit_data = updated_visit_data.drop_duplicates(subset=["Visit ID"], keep="last")
+    
+    conn.update(worksheet="Visits", data=updated_visit_data)
+    get_history_store(VISIT_HISTORY_SHEET).invalidate()
+
 def log_visit_to_gsheet(conn, visit_data):
     try:
-        existing_visit_data = conn.read(worksheet="Visits", ttl=5)
-        existing_visit_data = existing_visit_data.dropna(how='all')
-        
-        visit_data = visit_data.reindex(columns=VISIT_SHEET_COLUMNS)
-        
-        updated_visit_data = pd.concat([existing_visit_data, visit_data], ignore_index=True)
-        updated_visit_data = updated_visit_data.drop_duplicates(subset=["Visit ID"], keep="last")
-        
-        conn.update(worksheet="Visits", data=updated_visit_data)
+        write_visit_rows(conn, visit_data)
         st.success("Visit data successfully logged to Google Sheets!")
     except Exception as e:
-        st.error(f"Error logging visit data: {e}")
-        st.stop()
+        queue_failed_submission("visit", visit_data, visit_data['Employee Code'].iloc[0], e)
+
+def write_attendance_rows(conn, attendance_data):
+    if MONTHLY_PARTITIONS_ENABLED:
+        append_partitioned_rows(conn, "Attendance", attendance_data, "Attendance ID")
+        return
+    
+    existing_data = conn.read(worksheet="Attendance", ttl=5)
+    existing_data = existing_data.dropna(how='all')
+    
+    attendance_data = attendance_data.reindex(columns=ATTENDANCE_SHEET_COLUMNS)
+    
+    updated_data = pd.concat([existing_data, attendance_data], ignore_index=True)
+    updated_data = updated_data.drop_duplicates(subset=["Attendance ID"], keep="last")
+    
+    conn.update(worksheet="Attendance", data=updated_data)
 
 def log_attendance_to_gsheet(conn, attendance_data):
     try:
-        existing_data = conn.read(worksheet="Attendance", ttl=5)
-        existing_data = existing_data.dropna(how='all')
-        
-        attendance_data = attendance_data.reindex(columns=ATTENDANCE_SHEET_COLUMNS)
-        
-        updated_data = pd.concat([existing_data, attendance_data], ignore_index=True)
-        updated_data = updated_data.drop_duplicates(subset=["Attendance ID"], keep="last")
-        
-        conn.update(worksheet="Attendance", data=updated_data)
+        write_attendance_rows(conn, attendance_data)
         return True, None
     except Exception as e:
         return False, str(e)
 
+PENDING_SUBMISSIONS_DIR = "pending_submissions"
+SUBMISSION_RETRY_BASE_DELAY = 30
+SUBMISSION_RETRY_MAX_DELAY = 900
+SUBMISSION_RETRY_PACE = 5
+SUBMISSION_LABELS = {"sales": "Sale", "visit": "Visit", "attendance": "Attendance"}
+
+class SubmissionQueue:
+    """Failed sheet writes persisted under pending_submissions/ and retried in the background with backoff"""
+
+    def __init__(self, directory, writers):
+        self.directory = directory
+        self.writers = writers
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, submission_id):
+        return os.path.join(self.directory, f"{submission_id}.json")
+
+    def _save(self, submission):
+        path = self._path(submission["id"])
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(submission, f)
+        os.replace(f"{path}.tmp", path)
+
+    def add(self, kind, rows, employee_code, session_id, error):
+        submission = {
+            "id": f"{employee_code}_{kind}_{uuid.uuid4().hex[:8]}",
+            "kind": kind,
+            "employee_code": str(employee_code),
+            "session_id": session_id,
+            "created_at": time.time(),
+            "attempts": 0,
+            "next_attempt_at": time.time() + SUBMISSION_RETRY_BASE_DELAY,
+            "last_error": str(error),
+            "rows": json.loads(rows.to_json(orient="records", date_format="iso"))
+        }
+        with self._lock:
+            self._save(submission)
+        self._ensure_worker()
+        return submission["id"]
+
+    def pending(self, employee_code=None, kind=None):
+        prefix = "" if employee_code is None else f"{employee_code}_{kind or ''}"
+        submissions = []
+        with self._lock:
+            for name in sorted(os.listdir(self.directory)):
+                if not name.endswith(".json") or not name.startswith(prefix):
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        submission = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if employee_code is not None and submission["employee_code"] != str(employee_code):
+                    continue
+                if kind is None or submission["kind"] == kind:
+                    submissions.append(submission)
+        return submissions
+
+    def retry_now(self, employee_code):
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if name.startswith(f"{employee_code}_") and name.endswith(".json"):
+                    path = os.path.join(self.directory, name)
+                    with open(path) as f:
+                        submission = json.load(f)
+                    submission["next_attempt_at"] = 0
+                    self._save(submission)
+        self._ensure_worker()
+        self._wake.set()
+
+    def retry_due(self):
+        """Retry the most overdue submission, if any; returns whether one was attempted"""
+        due = [s for s in self.pending() if s["next_attempt_at"] <= time.time()]
+        if not due:
+            return False
+        submission = min(due, key=lambda s: s["next_attempt_at"])
+        try:
+            self.writers[submission["kind"]](conn, pd.DataFrame(submission["rows"]))
+        except Exception as e:
+            submission["attempts"] += 1
+            submission["last_error"] = str(e)
+            submission["next_attempt_at"] = time.time() + min(
+                SUBMISSION_RETRY_BASE_DELAY * 2 ** submission["attempts"], SUBMISSION_RETRY_MAX_DELAY
+            )
+            with self._lock:
+                self._save(submission)
+        else:
+            with self._lock:
+                os.remove(self._path(submission["id"]))
+        return True
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="submission-retry", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        # Runs for the life of the process, so a submission saved at any moment is picked up
+        while True:
+            try:
+                attempted = self.retry_due()
+            except Exception:
+                logger.exception("Submission retry failed")
+                attempted = True
+            if attempted:
+                # One write per pace interval at most, so a backlog drains without bursting the Sheets API
+                time.sleep(SUBMISSION_RETRY_PACE)
+            else:
+                self._wake.wait(SUBMISSION_RETRY_PACE)
+                self._wake.clear()
+
+@st.cache_resource
+def get_submission_queue():
+    queue = SubmissionQueue(PENDING_SUBMISSIONS_DIR, {
+        "sales": write_sales_rows,
+        "visit": write_visit_rows,
+        "attendance": write_attendance_rows
+    })
+    queue._ensure_worker()
+    return queue
+
+def queue_failed_submission(kind, rows, employee_code, error):
+    session_id = st.session_state.setdefault("submission_session_id", uuid.uuid4().hex)
+    submission_id = get_submission_queue().add(kind, rows, employee_code, session_id, error)
+    st.warning(
+        f"Couldn't reach Google Sheets ({error}). Your {SUBMISSION_LABELS[kind].lower()} has been saved "
+        f"and will be sent automatically when the connection recovers. Reference: {submission_id}"
+    )
+    return submission_id
+
+def render_pending_submissions(employee_name):
+    employee_code = Person.loc[Person['Employee Name'] == employee_name, 'Employee Code']
+    if employee_code.empty:
+        return
+    pending = get_submission_queue().pending(employee_code.iloc[0])
+    if not pending:
+        return
+    with st.expander(f"⏳ {len(pending)} submission(s) waiting to be sent", expanded=False):
+        st.dataframe(pd.DataFrame([{
+            "Type": SUBMISSION_LABELS.get(s["kind"], s["kind"]),
+            "Saved At": datetime.fromtimestamp(s["created_at"], pytz.timezone('Asia/Kolkata')).strftime("%d-%m-%Y %H:%M"),
+            "Attempts": s["attempts"],
+            "Next Try": datetime.fromtimestamp(s["next_attempt_at"], pytz.timezone('Asia/Kolkata')).strftime("%H:%M:%S"),
+            "Last Error": s["last_error"]
+        } for s in pending]), use_container_width=True, hide_index=True)
+        if st.button("Retry now", key="retry_pending_submissions"):
+            get_submission_queue().retry_now(employee_code.iloc[0])
+            st.rerun()
+
 def log_ticket_to_gsheet(conn, ticket_data):
     try:
         existing_data = conn.read(worksheet="Tickets", usecols=list(range(len(TICKET_SHEET_COLUMNS))), ttl=5)
@@ -549,80 +1876,283 @@ def log_demo_to_gsheet(conn, demo_data):
     except Exception as e:
         return False, str(e)
 
-def generate_invoice(customer_name, gst_number, contact_number, address, state, city, selected_products, quantities, product_discounts,
-                    discount_category, employee_name, payment_status, amount_paid, employee_selfie_path, payment_receipt_path, invoice_number,
-                    transaction_type, distributor_firm_name="", distributor_id="", distributor_contact_person="",
-                    distributor_contact_number="", distributor_email="", distributor_territory="", remarks="", invoice_date=None):
+def _split_positions(values):
+    """Explode a pipe-joined column into one row per item with its position in the list"""
+    items = values.fillna("").astype(str).str.split("|").explode()
+    items = items.to_frame("value").assign(position=items.groupby(level=0).cumcount())
+    return items.set_index("position", append=True)["value"]
+
+def explode_demo_products(demos):
+    """One row per demonstrated product, keyed by Demo ID"""
+    if demos.empty:
+        return pd.DataFrame(columns=DEMO_PRODUCT_COLUMNS)
+    demos = demos.reset_index(drop=True)
+    lines = pd.concat(
+        [_split_positions(demos['Products']).rename("Product Name"), _split_positions(demos['Quantities']).rename("Quantity")],
+        axis=1
+    ).reset_index(level="position", drop=True)
+    lines = lines[lines['Product Name'].fillna("").str.strip() != ""]
+    lines['Quantity'] = pd.to_numeric(lines['Quantity'], errors='coerce').fillna(1).astype(int)
+    header = demos[["Demo ID", "Employee Code", "Outlet Name", "Demo Date"]]
+    return header.join(lines, how='inner').reindex(columns=DEMO_PRODUCT_COLUMNS).reset_index(drop=True)
+
+def log_demo_products(conn, demo_data):
+    try:
+        existing_data = read_sheet_or_empty(conn, DEMO_PRODUCTS_SHEET, DEMO_PRODUCT_COLUMNS)
+        
+        updated_data = pd.concat([existing_data, explode_demo_products(demo_data)], ignore_index=True)
+        
+        replace_sheet(conn, DEMO_PRODUCTS_SHEET, updated_data)
+        return True, None
+    except Exception as e:
+        return False, str(e)
+
+def rebuild_demo_products(conn, demos=None):
+    """Backfill the demo products sheet from the full demo history"""
+    if demos is None:
+        demos = read_history_source(conn, DEMO_HISTORY_SHEET, DEMO_SHEET_COLUMNS)
+    demo_products = explode_demo_products(demos)
+    replace_sheet(conn, DEMO_PRODUCTS_SHEET, demo_products)
+    return demo_products
+
+def demo_conversion_summary(demo_products, sales, window_days=DEMO_CONVERSION_WINDOW_DAYS):
+    """Per product: how often it was demoed and how many demos were followed by a sale of it to the same outlet"""
+    columns = ["Product Name", "Demos", "Units Demoed", "Converted Demos", "Conversion Rate (%)"]
+    if demo_products.empty:
+        return pd.DataFrame(columns=columns)
+    
+    demos = demo_products.assign(outlet_key=demo_products['Outlet Name'].astype(str).str.strip().str.lower())
+    demos = demos.drop_duplicates(subset=["Demo ID", "Product Name"])
+    sold = sales.reindex(columns=['Outlet Name', 'Product Name', 'Invoice Date']).dropna()
+    sold['Invoice Date'] = pd.to_datetime(sold['Invoice Date'])
+    sold = sold.assign(outlet_key=sold['Outlet Name'].astype(str).str.strip().str.lower()).drop(columns='Outlet Name')
+    
+    matches = demos.merge(sold, on=['outlet_key', 'Product Name'], how='inner')
+    days_after = (matches['Invoice Date'] - matches['Demo Date']).dt.days
+    converted = matches.loc[(days_after >= 0) & (days_after <= window_days), ['Demo ID', 'Product Name']].drop_duplicates()
+    
+    summary = demos.groupby('Product Name').agg(Demos=('Demo ID', 'nunique'), **{'Units Demoed': ('Quantity', 'sum')})
+    summary['Converted Demos'] = converted.groupby('Product Name')['Demo ID'].nunique()
+    summary['Converted Demos'] = summary['Converted Demos'].fillna(0).astype(int)
+    summary['Conversion Rate (%)'] = (summary['Converted Demos'] / summary['Demos'] * 100).round(1)
+    return summary.reset_index().sort_values(['Demos', 'Converted Demos'], ascending=False)[columns]
+
+def render_demo_insights(demo_products):
+    if demo_products.empty:
+        st.info("No demonstrated products recorded yet.")
+        return
+    try:
+        sales = get_history_store(SALES_HISTORY_SHEET).snapshot()
+    except Exception as e:
+        st.error(f"Error loading sales data: {e}")
+        return
+    
+    summary = demo_conversion_summary(demo_products, sales)
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Demos", f"{demo_products['Demo ID'].nunique():,}")
+    col2.metric("Products Demoed", f"{summary['Demos'].sum():,}")
+    col3.metric("Converted to Sale", f"{summary['Converted Demos'].sum():,}")
+    
+    st.subheader("Most Demoed Products")
+    st.bar_chart(summary.set_index('Product Name')['Demos'].head(15))
+    st.subheader(f"Demo → Sale Conversion (sale to the same outlet within {DEMO_CONVERSION_WINDOW_DAYS} days)")
+    st.dataframe(summary, use_container_width=True, hide_index=True)
+
+INVOICE_TABLE_COLUMNS = [
+    ("S.No", 10, 'L'),
+    ("Product Name", 70, 'L'),
+    ("HSN/SAC", 20, 'C'),
+    ("Qty", 20, 'C'),
+    ("Rate (INR)", 25, 'R'),
+    ("Discount (%)", 25, 'R'),
+    ("Amount (INR)", 25, 'R')
+]
+INVOICE_TABLE_HEADER_HEIGHT = 10
+INVOICE_TABLE_ROW_HEIGHT = 8
+INVOICE_TABLE_LINE_HEIGHT = 5
+INVOICE_HSN_CODE = "3304"
+
+PRODUCT_LOOKUP = Products.drop_duplicates(subset="Product Name").set_index("Product Name", drop=False).to_dict("index")
+
+def price_invoice_lines(selected_products, quantities, product_discounts, discount_category):
+    """Resolve prices for each selected product once, for both the PDF table and the sales rows"""
+    lines = []
+    for product, quantity, prod_discount in zip(selected_products, quantities, product_discounts):
+        product_data = PRODUCT_LOOKUP[product]
+        
+        if discount_category in product_data:
+            unit_price = float(product_data[discount_category])
+        else:
+            unit_price = float(product_data['Price'])
+        
+        discounted_unit_price = unit_price * (1 - prod_discount/100)
+        lines.append({
+            "product": product,
+            "product_data": product_data,
+            "quantity": quantity,
+            "prod_discount": prod_discount,
+            "unit_price": unit_price,
+            "discounted_unit_price": discounted_unit_price,
+            "item_total": discounted_unit_price * quantity
+        })
+    return lines
+
+def wrap_text_to_width(pdf, text, width):
+    """Split text into lines that fit within width using the current font"""
+    lines = []
+    current = ""
+    for word in str(text).split():
+        candidate = f"{current} {word}" if current else word
+        if pdf.get_string_width(candidate) <= width:
+            current = candidate
+            continue
+        if current:
+            lines.append(current)
+        current = ""
+        for char in word:
+            if current and pdf.get_string_width(current + char) > width:
+                lines.append(current)
+                current = ""
+            current += char
+    if current or not lines:
+        lines.append(current)
+    return lines
+
+def measure_invoice_rows(pdf, lines):
+    """Pre-compute cell text and height for every table row"""
+    name_width = INVOICE_TABLE_COLUMNS[1][1] - 2
+    rows = []
+    for idx, line in enumerate(lines):
+        name_lines = wrap_text_to_width(pdf, line["product"], name_width)
+        rows.append({
+            "cells": [
+                str(idx + 1),
+                name_lines,
+                INVOICE_HSN_CODE,
+                str(line["quantity"]),
+                f"{line['unit_price']:.2f}",
+                f"{line['prod_discount']:.2f}%",
+                f"{line['item_total']:.2f}"
+            ],
+            "height": max(INVOICE_TABLE_ROW_HEIGHT, len(name_lines) * INVOICE_TABLE_LINE_HEIGHT),
+            "amount": line["item_total"]
+        })
+    return rows
+
+def paginate_invoice_rows(rows, first_page_space, page_space):
+    """Group measured rows into pages, leaving room for headers and carried-forward rows"""
+    pages = [[]]
+    # Every page has the column header and may need a carried-forward row at the bottom
+    available = first_page_space - INVOICE_TABLE_HEADER_HEIGHT - INVOICE_TABLE_ROW_HEIGHT
+    for row in rows:
+        if pages[-1] and row["height"] > available:
+            pages.append([])
+            # Continuation pages also carry a brought-forward row under the header
+            available = page_space - INVOICE_TABLE_HEADER_HEIGHT - 2 * INVOICE_TABLE_ROW_HEIGHT
+        pages[-1].append(row)
+        available -= row["height"]
+    return pages
+
+def draw_invoice_table_header(pdf):
+    pdf.set_fill_color(200, 220, 255)
+    pdf.set_font('Arial', 'B', 10)
+    for title, width, _ in INVOICE_TABLE_COLUMNS:
+        pdf.cell(width, INVOICE_TABLE_HEADER_HEIGHT, title, border=1, align='C', fill=True)
+    pdf.ln()
+
+def draw_invoice_balance_row(pdf, label, amount):
+    label_width = sum(width for _, width, _ in INVOICE_TABLE_COLUMNS[:-1])
+    pdf.set_font('Arial', 'B', 10)
+    pdf.cell(label_width, INVOICE_TABLE_ROW_HEIGHT, label, border=1, align='R')
+    pdf.cell(INVOICE_TABLE_COLUMNS[-1][1], INVOICE_TABLE_ROW_HEIGHT, f"{amount:.2f}", border=1, align='R')
+    pdf.ln()
+
+def draw_invoice_row(pdf, row):
+    x = pdf.l_margin
+    y = pdf.get_y()
+    height = row["height"]
+    for (_, width, align), value in zip(INVOICE_TABLE_COLUMNS, row["cells"]):
+        pdf.rect(x, y, width, height)
+        if isinstance(value, list):
+            pdf.set_xy(x, y + (height - len(value) * INVOICE_TABLE_LINE_HEIGHT) / 2)
+            for text in value:
+                pdf.set_x(x)
+                pdf.cell(width, INVOICE_TABLE_LINE_HEIGHT, text, align=align)
+                pdf.ln(INVOICE_TABLE_LINE_HEIGHT)
+        else:
+            pdf.set_xy(x, y)
+            pdf.cell(width, height, value, align=align)
+        x += width
+    pdf.set_xy(pdf.l_margin, y + height)
+
+def draw_invoice_table(pdf, lines, body_top):
+    """Lay out the line item table page by page with repeated headers and running subtotals"""
+    pdf.set_font('Arial', '', 10)
+    rows = measure_invoice_rows(pdf, lines)
+    page_bottom = pdf.h - pdf.b_margin
+    pages = paginate_invoice_rows(rows, page_bottom - pdf.get_y(), page_bottom - body_top)
+
+    auto_page_break = pdf.auto_page_break
+    pdf.set_auto_page_break(False, margin=pdf.b_margin)
+    running_total = 0
+    for page_number, page_rows in enumerate(pages):
+        if page_number > 0:
+            pdf.add_page()
+        draw_invoice_table_header(pdf)
+        if page_number > 0:
+            draw_invoice_balance_row(pdf, "Brought Forward", running_total)
+        pdf.set_font('Arial', '', 10)
+        for row in page_rows:
+            draw_invoice_row(pdf, row)
+            running_total += row["amount"]
+        if page_number < len(pages) - 1:
+            draw_invoice_balance_row(pdf, "Carried Forward", running_total)
+    pdf.set_auto_page_break(auto_page_break, margin=pdf.b_margin)
+    return running_total
+
+def new_invoice_pdf():
     pdf = PDF()
+    if INVOICE_PDF_MODE == "compact":
+        pdf.set_compression(True)
     pdf.alias_nb_pages()
+    return pdf
+
+def render_invoice_pages(pdf, invoice, lines):
+    """Draw one invoice starting on a new page and return its subtotal"""
     pdf.add_page()
-    current_date = invoice_date if invoice_date else get_ist_time().strftime("%d-%m-%Y")
+    body_top = pdf.get_y()
 
     pdf.set_font("Arial", 'B', 12)
-    pdf.cell(0, 10, f"Transaction Type: {transaction_type.upper()}", ln=True)
+    pdf.cell(0, 10, f"Transaction Type: {invoice['transaction_type'].upper()}", ln=True)
     
     pdf.ln(0)
     pdf.set_font("Arial", 'B', 10)
-    pdf.cell(0, 10, f"Sales Person: {employee_name}", ln=True, align='L')
+    pdf.cell(0, 10, f"Sales Person: {invoice['employee_name']}", ln=True, align='L')
     
-    if distributor_firm_name:
-        pdf.cell(0, 10, f"Distributor: {distributor_firm_name} ({distributor_id})", ln=True, align='L')
-        pdf.cell(0, 10, f"Contact: {distributor_contact_person} | {distributor_contact_number}", ln=True, align='L')
-        pdf.cell(0, 10, f"Territory: {distributor_territory}", ln=True, align='L')
+    if invoice['distributor_firm_name']:
+        pdf.cell(0, 10, f"Distributor: {invoice['distributor_firm_name']} ({invoice['distributor_id']})", ln=True, align='L')
+        pdf.cell(0, 10, f"Contact: {invoice['distributor_contact_person']} | {invoice['distributor_contact_number']}", ln=True, align='L')
+        pdf.cell(0, 10, f"Territory: {invoice['distributor_territory']}", ln=True, align='L')
     
     pdf.ln(5)
 
     pdf.set_font('Arial', 'B', 12)
     pdf.cell(0, 10, "Bill To:", ln=True)
     pdf.set_font('Arial', '', 10)
-    pdf.cell(100, 6, f"Name: {customer_name}")
-    pdf.cell(90, 6, f"Date: {current_date}", ln=True, align='R')
-    pdf.cell(100, 6, f"GSTIN/UN: {gst_number}")
-    pdf.cell(90, 6, f"Contact: {contact_number}", ln=True, align='R')
+    pdf.cell(100, 6, f"Name: {invoice['customer_name']}")
+    pdf.cell(90, 6, f"Date: {invoice['invoice_date']}", ln=True, align='R')
+    pdf.cell(100, 6, f"GSTIN/UN: {invoice['gst_number']}")
+    pdf.cell(90, 6, f"Contact: {invoice['contact_number']}", ln=True, align='R')
     pdf.cell(100, 6, "Address: ", ln=True)
-    pdf.multi_cell(0, 6, address)
+    pdf.multi_cell(0, 6, invoice['address'])
     pdf.ln(1)
     
     pdf.set_font('Arial', 'B', 10)
-    pdf.cell(0, 10, f"Invoice Number: {invoice_number}", ln=True)
+    pdf.cell(0, 10, f"Invoice Number: {invoice['invoice_number']}", ln=True)
     pdf.ln(5)
     
-    pdf.set_fill_color(200, 220, 255)
-    pdf.set_font('Arial', 'B', 10)
-    pdf.cell(10, 10, "S.No", border=1, align='C', fill=True)
-    pdf.cell(70, 10, "Product Name", border=1, align='C', fill=True)
-    pdf.cell(20, 10, "HSN/SAC", border=1, align='C', fill=True)
-    pdf.cell(20, 10, "Qty", border=1, align='C', fill=True)
-    pdf.cell(25, 10, "Rate (INR)", border=1, align='C', fill=True)
-    pdf.cell(25, 10, "Discount (%)", border=1, align='C', fill=True)
-    pdf.cell(25, 10, "Amount (INR)", border=1, align='C', fill=True)
-    pdf.ln()
-
-    pdf.set_font('Arial', '', 10)
-    sales_data = []
     tax_rate = 0.18
-    
-    subtotal = 0
-    for idx, (product, quantity, prod_discount) in enumerate(zip(selected_products, quantities, product_discounts)):
-        product_data = Products[Products['Product Name'] == product].iloc[0]
-        
-        if discount_category in product_data:
-            unit_price = float(product_data[discount_category])
-        else:
-            unit_price = float(product_data['Price'])
-        
-        discounted_unit_price = unit_price * (1 - prod_discount/100)
-        item_total = discounted_unit_price * quantity
-        subtotal += item_total
-        
-        pdf.cell(10, 8, str(idx + 1), border=1)
-        pdf.cell(70, 8, product, border=1)
-        pdf.cell(20, 8, "3304", border=1, align='C')
-        pdf.cell(20, 8, str(quantity), border=1, align='C')
-        pdf.cell(25, 8, f"{unit_price:.2f}", border=1, align='R')
-        pdf.cell(25, 8, f"{prod_discount:.2f}%", border=1, align='R')
-        pdf.cell(25, 8, f"{item_total:.2f}", border=1, align='R')
-        pdf.ln()
+    subtotal = draw_invoice_table(pdf, lines, body_top)
 
     tax_amount = subtotal * tax_rate
     cgst_amount = tax_amount / 2
@@ -652,33 +2182,59 @@ def generate_invoice(customer_name, gst_number, contact_number, address, state,
     pdf.ln(10)
     
     pdf.set_font("Arial", 'B', 12)
-    pdf.cell(0, 10, f"Payment Status: {payment_status.upper()}", ln=True)
-    if payment_status == "paid":
-        pdf.cell(0, 10, f"Amount Paid: {amount_paid} INR", ln=True)
+    pdf.cell(0, 10, f"Payment Status: {invoice['payment_status'].upper()}", ln=True)
+    if invoice['payment_status'] == "paid":
+        pdf.cell(0, 10, f"Amount Paid: {invoice['amount_paid']} INR", ln=True)
     pdf.ln(10)
     
     pdf.set_font("Arial", 'B', 12)
     pdf.cell(0, 10, "Details:", ln=True)
     pdf.set_font("Arial", '', 10)
     pdf.multi_cell(0, 5, bank_details)
+    return subtotal
 
-    for idx, (product, quantity, prod_discount) in enumerate(zip(selected_products, quantities, product_discounts)):
-        product_data = Products[Products['Product Name'] == product].iloc[0]
-        
-        if discount_category in product_data:
-            unit_price = float(product_data[discount_category])
-        else:
-            unit_price = float(product_data['Price'])
-            
-        discounted_unit_price = unit_price * (1 - prod_discount/100)
-        item_total = discounted_unit_price * quantity
+def generate_invoice(customer_name, gst_number, contact_number, address, state, city, selected_products, quantities, product_discounts,
+                    discount_category, employee_name, payment_status, amount_paid, employee_selfie_path, payment_receipt_path, invoice_number,
+                    transaction_type, distributor_firm_name="", distributor_id="", distributor_contact_person="",
+                    distributor_contact_number="", distributor_email="", distributor_territory="", remarks="", invoice_date=None):
+    pdf = new_invoice_pdf()
+    current_date = invoice_date if invoice_date else get_ist_time().strftime("%d-%m-%Y")
+    
+    sales_data = []
+    tax_rate = 0.18
+    
+    lines = price_invoice_lines(selected_products, quantities, product_discounts, discount_category)
+    render_invoice_pages(pdf, {
+        "customer_name": customer_name,
+        "gst_number": gst_number,
+        "contact_number": contact_number,
+        "address": address,
+        "invoice_date": current_date,
+        "invoice_number": invoice_number,
+        "transaction_type": transaction_type,
+        "employee_name": employee_name,
+        "payment_status": payment_status,
+        "amount_paid": amount_paid,
+        "distributor_firm_name": distributor_firm_name,
+        "distributor_id": distributor_id,
+        "distributor_contact_person": distributor_contact_person,
+        "distributor_contact_number": distributor_contact_number,
+        "distributor_territory": distributor_territory
+    }, lines)
+
+    employee_code = Person[Person['Employee Name'] == employee_name]['Employee Code'].values[0]
+    designation = Person[Person['Employee Name'] == employee_name]['Designation'].values[0]
+
+    for line in lines:
+        product_data = line["product_data"]
+        item_total = line["item_total"]
         
         sales_data.append({
             "Invoice Number": invoice_number,
             "Invoice Date": current_date,
             "Employee Name": employee_name,
-            "Employee Code": Person[Person['Employee Name'] == employee_name]['Employee Code'].values[0],
-            "Designation": Person[Person['Employee Name'] == employee_name]['Designation'].values[0],
+            "Employee Code": employee_code,
+            "Designation": designation,
             "Discount Category": discount_category,
             "Transaction Type": transaction_type,
             "Outlet Name": customer_name,
@@ -693,12 +2249,12 @@ def generate_invoice(customer_name, gst_number, contact_number, address, state,
             "Distributor Email": distributor_email,
             "Distributor Territory": distributor_territory,
             "Product ID": product_data['Product ID'],
-            "Product Name": product,
+            "Product Name": line["product"],
             "Product Category": product_data['Product Category'],
-            "Quantity": quantity,
-            "Unit Price": unit_price,
-            "Product Discount (%)": prod_discount,
-            "Discounted Unit Price": discounted_unit_price,
+            "Quantity": line["quantity"],
+            "Unit Price": line["unit_price"],
+            "Product Discount (%)": line["prod_discount"],
+            "Discounted Unit Price": line["discounted_unit_price"],
             "Total Price": item_total,
             "GST Rate": "18%",
             "CGST Amount": (item_total * tax_rate) / 2,
@@ -708,18 +2264,99 @@ def generate_invoice(customer_name, gst_number, contact_number, address, state,
             "Amount Paid": amount_paid if payment_status == "paid" else 0,
             "Payment Receipt Path": payment_receipt_path if payment_status == "paid" else "",
             "Employee Selfie Path": employee_selfie_path,
-            "Invoice PDF Path": f"invoices/{invoice_number}.pdf",
+            "Invoice PDF Path": f"invoices/{invoice_number}.pdf" if INVOICE_ARCHIVE_ENABLED else "",
             "Remarks": remarks,
             "Delivery Status": "pending"
         })
 
     pdf_path = f"invoices/{invoice_number}.pdf"
-    pdf.output(pdf_path)
+    pdf_bytes = pdf_to_bytes(pdf)
+    archive_invoice_pdf(pdf_path, pdf_bytes)
     
     sales_df = pd.DataFrame(sales_data)
     log_sales_to_gsheet(conn, sales_df)
 
-    return pdf, pdf_path
+    return pdf_bytes, pdf_path
+
+INVOICE_BATCH_FORMATS = {"Merged PDF": "pdf", "ZIP of PDFs": "zip"}
+
+def fetch_invoice_lines(conn, invoice_numbers):
+    """Read the line items for several invoices with a single sheet read"""
+    sales_data = conn.read(worksheet=SALES_HISTORY_SHEET, ttl=5)
+    sales_data = sales_data.dropna(how='all')
+    sales_data['Invoice Number'] = sales_data['Invoice Number'].astype(str)
+    return sales_data[sales_data['Invoice Number'].isin([str(n) for n in invoice_numbers])]
+
+def _sheet_value(row, column, default=""):
+    value = row.get(column, default)
+    return default if pd.isna(value) else value
+
+def _sheet_number(row, column):
+    value = pd.to_numeric(_sheet_value(row, column, 0), errors='coerce')
+    return 0.0 if pd.isna(value) else float(value)
+
+def invoice_from_sales_rows(rows):
+    """Rebuild an invoice header and its priced lines from stored Sales rows"""
+    first = rows.iloc[0]
+    invoice_date = first['Invoice Date']
+    if isinstance(invoice_date, (pd.Timestamp, datetime)):
+        invoice_date = invoice_date.strftime("%d-%m-%Y")
+    invoice = {
+        "customer_name": str(_sheet_value(first, 'Outlet Name')),
+        "gst_number": str(_sheet_value(first, 'GST Number')),
+        "contact_number": str(_sheet_value(first, 'Outlet Contact')),
+        "address": str(_sheet_value(first, 'Outlet Address')),
+        "invoice_date": str(invoice_date),
+        "invoice_number": str(first['Invoice Number']),
+        "transaction_type": str(_sheet_value(first, 'Transaction Type')),
+        "employee_name": str(_sheet_value(first, 'Employee Name')),
+        "payment_status": str(_sheet_value(first, 'Payment Status')),
+        "amount_paid": _sheet_number(first, 'Amount Paid'),
+        "distributor_firm_name": str(_sheet_value(first, 'Distributor Firm Name')),
+        "distributor_id": str(_sheet_value(first, 'Distributor ID')),
+        "distributor_contact_person": str(_sheet_value(first, 'Distributor Contact Person')),
+        "distributor_contact_number": str(_sheet_value(first, 'Distributor Contact Number')),
+        "distributor_territory": str(_sheet_value(first, 'Distributor Territory'))
+    }
+    lines = []
+    for record in rows.to_dict('records'):
+        quantity = _sheet_number(record, 'Quantity')
+        if quantity.is_integer():
+            quantity = int(quantity)
+        prod_discount = _sheet_number(record, 'Product Discount (%)')
+        unit_price = _sheet_number(record, 'Unit Price')
+        discounted_unit_price = unit_price * (1 - prod_discount/100)
+        lines.append({
+            "product": str(record['Product Name']),
+            "quantity": quantity,
+            "prod_discount": prod_discount,
+            "unit_price": unit_price,
+            "discounted_unit_price": discounted_unit_price,
+            "item_total": discounted_unit_price * quantity
+        })
+    return invoice, lines
+
+def render_invoice_batch(invoice_numbers, output_format="pdf", invoice_lines=None):
+    """Render several invoices into one merged PDF or a ZIP of PDFs and return the bytes"""
+    if invoice_lines is None:
+        invoice_lines = fetch_invoice_lines(conn, invoice_numbers)
+    invoice_lines = invoice_lines.assign(**{'Invoice Number': invoice_lines['Invoice Number'].astype(str)})
+    grouped = {number: rows for number, rows in invoice_lines.groupby('Invoice Number', sort=False)}
+    ordered = [str(n) for n in invoice_numbers if str(n) in grouped]
+
+    if output_format == "zip":
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for number in ordered:
+                pdf = new_invoice_pdf()
+                render_invoice_pages(pdf, *invoice_from_sales_rows(grouped[number]))
+                archive.writestr(f"{number}.pdf", pdf_to_bytes(pdf))
+        return buffer.getvalue()
+
+    pdf = new_invoice_pdf()
+    for number in ordered:
+        render_invoice_pages(pdf, *invoice_from_sales_rows(grouped[number]))
+    return pdf_to_bytes(pdf)
 
 def record_visit(employee_name, outlet_name, outlet_contact, outlet_address, outlet_state, outlet_city, 
                  visit_purpose, visit_notes, visit_selfie_path, entry_time, exit_time, remarks=""):
@@ -754,7 +2391,7 @@ def record_visit(employee_name, outlet_name, outlet_contact, outlet_address, out
     
     return visit_id
 
-def record_attendance(employee_name, status, location_link="", leave_reason=""):
+def record_attendance(employee_name, status, location_link="", leave_reason="", geofence=("", "", None)):
     try:
         employee_code = Person[Person['Employee Name'] == employee_name]['Employee Code'].values[0]
         designation = Person[Person['Employee Name'] == employee_name]['Designation'].values[0]
@@ -774,42 +2411,91 @@ def record_attendance(employee_name, status, location_link="", leave_reason=""):
             "Location Link": location_link,
             "Leave Reason": leave_reason,
             "Check-in Time": check_in_time,
-            "Check-in Date Time": current_datetime
+            "Check-in Date Time": current_datetime,
+            "Geofence Status": geofence[0],
+            "Nearest Location": geofence[1],
+            "Distance (m)": geofence[2]
         }
         
         attendance_df = pd.DataFrame([attendance_data])
         
         success, error = log_attendance_to_gsheet(conn, attendance_df)
+        if not success:
+            # Kept for automatic retry, so the employee is treated as checked in
+            queue_failed_submission("attendance", attendance_df, employee_code, error)
         
-        if success:
-            return attendance_id, None
-        else:
-            return None, error
+        get_attendance_index().add(attendance_data)
+        return attendance_id, None
             
     except Exception as e:
         return None, f"Error creating attendance record: {str(e)}"
 
-def check_existing_attendance(employee_name):
+ATTENDANCE_INDEX_TTL = 120
+
+class AttendanceIndex:
+    """Today's attendance records keyed by employee code, shared by every session"""
+
+    def __init__(self):
+        self.date = None
+        self.records = {}
+        self.rows_seen = 0
+        self.loaded_at = 0
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        today = get_ist_time().strftime("%d-%m-%Y")
+        with self._lock:
+            if today != self.date:
+                self.date = today
+                self.records = {}
+                self.rows_seen = 0
+            elif not force and time.time() - self.loaded_at <= ATTENDANCE_INDEX_TTL:
+                return
+            
+            today_date = get_ist_time().date()
+            data = read_partitioned_rows(conn, "Attendance", today_date, today_date)
+            # The sheet is append-only, so only rows past the last scan can hold new records
+            if len(data) < self.rows_seen:
+                self.records = {}
+                self.rows_seen = 0
+            if not data.empty:
+                tail = data.iloc[self.rows_seen:]
+                for record in tail[tail['Date'].astype(str) == today].to_dict('records'):
+                    self.records.setdefault(str(record['Employee Code']), record)
+            self.rows_seen = len(data)
+            self.loaded_at = time.time()
+
+    def get(self, employee_code):
+        self.refresh()
+        record = self.records.get(str(employee_code))
+        if record is None:
+            # A check-in still waiting in the submission queue (e.g. across a restart) counts too
+            for submission in get_submission_queue().pending(employee_code, "attendance"):
+                for row in submission["rows"]:
+                    if str(row.get("Date")) == self.date:
+                        return row
+        return record
+
+    def add(self, record):
+        """Record a check-in written by this process without re-reading the sheet"""
+        with self._lock:
+            if record['Date'] == self.date:
+                self.records.setdefault(str(record['Employee Code']), record)
+
+@st.cache_resource
+def get_attendance_index():
+    return AttendanceIndex()
+
+def get_today_attendance(employee_name):
     try:
-        existing_data = conn.read(worksheet="Attendance", usecols=list(range(len(ATTENDANCE_SHEET_COLUMNS))), ttl=5)
-        existing_data = existing_data.dropna(how='all')
-        
-        if existing_data.empty:
-            return False
-        
-        current_date = get_ist_time().strftime("%d-%m-%Y")
         employee_code = Person[Person['Employee Name'] == employee_name]['Employee Code'].values[0]
-        
-        existing_records = existing_data[
-            (existing_data['Employee Code'] == employee_code) & 
-            (existing_data['Date'] == current_date)
-        ]
-        
-        return not existing_records.empty
-        
+        return get_attendance_index().get(employee_code)
     except Exception as e:
         st.error(f"Error checking existing attendance: {str(e)}")
-        return False
+        return None
+
+def check_existing_attendance(employee_name):
+    return get_today_attendance(employee_name) is not None
 
 def authenticate_employee(employee_name, passkey):
     try:
@@ -818,6 +2504,142 @@ def authenticate_employee(employee_name, passkey):
     except:
         return False
 
+HISTORY_PAGE_SIZES = [10, 25, 50, 100]
+
+def _shift_page(page_key, step):
+    st.session_state[page_key] = st.session_state.get(page_key, 1) + step
+
+def paginate_dataframe(data, key, default_page_size=25):
+    """Render paging controls and return only the rows on the current page"""
+    total = len(data)
+    page_key = f"{key}_page"
+    
+    col1, col2, col3, col4 = st.columns([2, 1, 3, 1])
+    with col1:
+        page_size = st.selectbox(
+            "Rows per page",
+            HISTORY_PAGE_SIZES,
+            index=HISTORY_PAGE_SIZES.index(default_page_size),
+            key=f"{key}_page_size",
+            label_visibility="collapsed"
+        )
+    page_count = max(1, -(-total // page_size))
+    page = min(max(st.session_state.get(page_key, 1), 1), page_count)
+    st.session_state[page_key] = page
+    
+    start = (page - 1) * page_size
+    end = min(start + page_size, total)
+    with col2:
+        st.button("◀ Prev", key=f"{key}_prev", disabled=page <= 1, on_click=_shift_page, args=(page_key, -1))
+    with col3:
+        st.caption(f"Page {page} of {page_count} · showing {start + 1 if total else 0}–{end} of {total}")
+    with col4:
+        st.button("Next ▶", key=f"{key}_next", disabled=page >= page_count, on_click=_shift_page, args=(page_key, 1))
+    
+    return data.iloc[start:end]
+
+EXPORT_CHUNK_ROWS = 5000
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "CSV (gzip)": ("csv.gz", "application/gzip"),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+}
+
+def iter_export_chunks(data, chunk_rows=EXPORT_CHUNK_ROWS):
+    for start in range(0, max(len(data), 1), chunk_rows):
+        yield start == 0, data.iloc[start:start + chunk_rows]
+
+def write_csv_export(data, compress=False):
+    """Write data as CSV chunk by chunk, optionally gzip-compressed"""
+    buffer = io.BytesIO()
+    stream = gzip.GzipFile(fileobj=buffer, mode='wb') if compress else buffer
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    for first, chunk in iter_export_chunks(data):
+        chunk.to_csv(text, index=False, header=first)
+    text.flush()
+    text.detach()
+    if compress:
+        stream.close()
+    return buffer.getvalue()
+
+def write_xlsx_export(data, sheet_name="Export"):
+    """Write data as an XLSX workbook in write-only mode, chunk by chunk"""
+    from openpyxl import Workbook
+    
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title=sheet_name)
+    worksheet.append([str(col) for col in data.columns])
+    for _, chunk in iter_export_chunks(data):
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        for row in chunk.itertuples(index=False, name=None):
+            worksheet.append(list(row))
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+def build_history_export(data, export_format):
+    if export_format == "Excel":
+        return write_xlsx_export(data)
+    return write_csv_export(data, compress=export_format == "CSV (gzip)")
+
+def _clear_export(export_key):
+    st.session_state.pop(export_key, None)
+
+def frame_signature(data):
+    """Content hash of a frame, so a prepared export is dropped when the rows behind it change"""
+    try:
+        hashes = pd.util.hash_pandas_object(data, index=False)
+    except TypeError:
+        # Query results can hold unhashable values such as lists
+        hashes = pd.util.hash_pandas_object(data.astype(str), index=False)
+    return (tuple(data.columns), int(hashes.sum()))
+
+def render_prepared_download(key, signature, build, label, file_name, mime, prepare_label="Prepare export"):
+    """A prepare button that runs build() only when clicked, then a download button that drops the prepared bytes"""
+    export_key = f"{key}_export"
+    # An export prepared for other data is stale
+    prepared = st.session_state.get(export_key)
+    if prepared and prepared[0] != signature:
+        _clear_export(export_key)
+        prepared = None
+    
+    if prepared is None:
+        if st.button(prepare_label, key=f"{key}_prepare_export"):
+            with st.spinner("Preparing export..."):
+                st.session_state[export_key] = (signature, build())
+            st.rerun()
+    else:
+        st.download_button(
+            label,
+            prepared[1],
+            file_name,
+            mime,
+            key=f"download-{key}",
+            on_click=_clear_export,
+            args=(export_key,)
+        )
+
+def render_history_export(data, key, file_stem, label="Download"):
+    """Offer a download of data that is only built when the user asks for it"""
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        export_format = st.selectbox(
+            "Export format",
+            list(EXPORT_FORMATS),
+            key=f"{key}_export_format",
+            label_visibility="collapsed"
+        )
+    extension, mime = EXPORT_FORMATS[export_format]
+    with col2:
+        render_prepared_download(
+            key,
+            (export_format, file_stem, frame_signature(data)),
+            lambda: build_history_export(data, export_format),
+            label,
+            f"{file_stem}.{extension}",
+            mime
+        )
+
 def resources_page():
     hourly_location_auto_log(conn, st.session_state.employee_name)
     st.title("Company Resources")
@@ -880,7 +2702,7 @@ def demo_page():
     st.title("Demo Management")
     selected_employee = st.session_state.employee_name
 
-    tab1, tab2 = st.tabs(["New Demo", "Demo History"])
+    tab1, tab2, tab3 = st.tabs(["New Demo", "Demo History", "Demo Insights"])
 
     with tab1:
         st.subheader("Partner Employee")
@@ -969,36 +2791,53 @@ def demo_page():
                     "Quantities": "|".join(quantities)
                 }
 
-                success, error = log_demo_to_gsheet(conn, pd.DataFrame([demo_data], columns=DEMO_SHEET_COLUMNS))
+                demo_frame = pd.DataFrame([demo_data], columns=DEMO_SHEET_COLUMNS)
+                success, error = log_demo_to_gsheet(conn, demo_frame)
                 if success:
+                    get_history_store(DEMO_HISTORY_SHEET).invalidate()
                     st.success(f"Demo {demo_id} recorded successfully!")
                     
+                    success, error = log_demo_products(conn, demo_frame)
+                    if success:
+                        get_history_store(DEMO_PRODUCTS_SHEET).invalidate()
+                    else:
+                        st.warning(f"Demo saved, but its product lines could not be recorded: {error}")
                 else:
                     st.error(f"Failed to record demo: {error}")
             else:
                 st.error("Please fill all required fields (Outlet + ≥1 product).")
 
+    employee_code = Person.loc[Person['Employee Name']==selected_employee,'Employee Code'].iat[0]
+
+    # Rendered before the history tab, which returns early when there is nothing to show
+    with tab3:
+        st.subheader("Demo Insights")
+        try:
+            demo_products = get_history_store(DEMO_PRODUCTS_SHEET).for_employee(employee_code)
+        except Exception as e:
+            st.error(f"Error loading demonstrated products: {e}")
+        else:
+            render_demo_insights(demo_products)
+
     with tab2:
         st.subheader("Demo History")
+        try:
+            demo_query = get_history_store(DEMO_HISTORY_SHEET).query(employee_code, 'Demo Date', ['Demo ID', 'Outlet Name'])
+        except Exception as e:
+            st.error(f"Error loading demo data: {e}")
+            return
 
-        @st.cache_data(ttl=300)
-        def load_demo_data():
-            try:
-                df = conn.read(worksheet=DEMO_HISTORY_SHEET, ttl=5)
-                df = df.dropna(how='all')
-                df['Demo Date'] = pd.to_datetime(df['Demo Date'], dayfirst=True, errors='coerce')
-                df['Duration (minutes)'] = pd.to_numeric(df['Duration (minutes)'], errors='coerce')
-                code = Person.loc[Person['Employee Name']==selected_employee,'Employee Code'].iat[0]
-                return df[df['Employee Code']==code].sort_values('Demo Date', ascending=False)
-            except Exception as e:
-                st.error(f"Error loading demo data: {e}")
-                return pd.DataFrame()
-
-        demo_data = load_demo_data()
-        if demo_data.empty:
+        if len(demo_query) == 0:
             st.warning("No demo records found for your account")
             return
 
+        with st.expander("📝 Search Demo Remarks"):
+            render_text_search(
+                DEMO_HISTORY_SHEET, employee_code, "demo_remarks_search",
+                ['Demo ID', 'Demo Date', 'Outlet Name', 'Remarks'],
+                "Search demo remarks"
+            )
+
         with st.expander("🔍 Search Filters", expanded=True):
             c1, c2, c3 = st.columns(3)
             with c1:
@@ -1010,24 +2849,20 @@ def demo_page():
             if st.button("Apply Filters", key="search_demo_button"):
                 st.rerun()
 
-        filtered = demo_data.copy()
-        if fid:  filtered = filtered[filtered['Demo ID'].str.contains(fid, case=False, na=False)]
-        if fdate:
-            ds = fdate.strftime("%d-%m-%Y")
-            filtered = filtered[filtered['Demo Date'].dt.strftime('%d-%m-%Y') == ds]
-        if fout: filtered = filtered[filtered['Outlet Name'].str.contains(fout, case=False, na=False)]
+        filtered = demo_query.filter(date=fdate, contains={'Demo ID': fid, 'Outlet Name': fout})
 
         if filtered.empty:
             st.warning("No matching records found")
             return
 
-        st.write(f"📄 Showing {len(filtered)} of your demos")
+        st.write(f"📄 Found {len(filtered)} of your demos")
         summary_cols = [
             'Demo ID','Demo Date','Outlet Name','Partner Employee',
             'Check-in Time','Check-out Time','Duration (minutes)','Outlet Review'
         ]
+        demo_page_rows = paginate_dataframe(filtered, "demo_history")
         st.dataframe(
-            filtered[summary_cols],
+            demo_page_rows[summary_cols],
             column_config={"Demo Date": st.column_config.DateColumn(format="DD/MM/YYYY")},
             use_container_width=True,
             hide_index=True
@@ -1050,21 +2885,20 @@ def demo_page():
             st.metric("Review", details['Outlet Review'])
 
         st.subheader("Products Demonstrated")
-        prod_str = str(details.get('Products',''))
-        qty_str  = str(details.get('Quantities',''))
-        prods = prod_str.split("|") if prod_str else []
-        qtys  = qty_str.split("|")  if qty_str  else []
-        L = max(len(prods), len(qtys))
-        prods += [""]*(L-len(prods))
-        qtys  += [""]*(L-len(qtys))
-        df_pd = pd.DataFrame({"Product": prods, "Quantity": qtys})
-        st.dataframe(df_pd, use_container_width=True, hide_index=True)
+        try:
+            demo_products = get_history_store(DEMO_PRODUCTS_SHEET).for_employee(employee_code)
+            demo_lines = demo_products.loc[demo_products['Demo ID'] == sel, ['Product Name', 'Quantity']]
+            if demo_lines.empty:
+                # Not in DemoProducts yet (e.g. before the next rebuild), so split the demo's own product list
+                demo_lines = explode_demo_products(filtered[filtered['Demo ID'] == sel])[['Product Name', 'Quantity']]
+            st.dataframe(demo_lines, use_container_width=True, hide_index=True)
+        except Exception as e:
+            st.error(f"Error loading demonstrated products: {e}")
 
         st.subheader("Remarks")
         st.write(details['Remarks'])
 
-        csv = filtered.to_csv(index=False).encode('utf-8')
-        st.download_button("Download Demo History", csv, "demo_history.csv", "text/csv", key='download-demo-csv')
+        render_history_export(filtered, "demo_history", "demo_history", "Download Demo History")
 
 def support_ticket_page():
     hourly_location_auto_log(conn, st.session_state.employee_name)
@@ -1160,6 +2994,7 @@ def support_ticket_page():
                         success, error = log_ticket_to_gsheet(conn, ticket_df)
                         
                         if success:
+                            get_history_store(TICKET_HISTORY_SHEET).invalidate()
                             st.success(f"""
                             Your ticket has been submitted successfully! 
                             We will update you within 48 hours regarding this matter.
@@ -1174,14 +3009,10 @@ def support_ticket_page():
     with tab2:
         st.subheader("My Support Tickets")
         try:
-            tickets_data = conn.read(worksheet=TICKET_HISTORY_SHEET, usecols=list(range(len(TICKET_SHEET_COLUMNS))), ttl=5)
-            tickets_data = tickets_data.dropna(how="all")
+            ticket_store = get_history_store(TICKET_HISTORY_SHEET)
+            my_tickets = ticket_store.for_employee(employee_code)
             
-            if not tickets_data.empty:
-                my_tickets = tickets_data[
-                    tickets_data['Raised By (Employee Name)'] == selected_employee
-                ].sort_values(by="Date Raised", ascending=False)
-                
+            if not ticket_store.data.empty:
                 if not my_tickets.empty:
                     pending_count = len(my_tickets[my_tickets['Status'] == "Open"])
                     resolved_count = len(my_tickets[my_tickets['Status'] == "Resolved"])
@@ -1191,6 +3022,13 @@ def support_ticket_page():
                     col2.metric("Open", pending_count)
                     col3.metric("Resolved", resolved_count)
                     
+                    with st.expander("📝 Search Ticket Details"):
+                        render_text_search(
+                            TICKET_HISTORY_SHEET, employee_code, "ticket_text_search",
+                            ['Ticket ID', 'Date Raised', 'Subject', 'Details', 'Status'],
+                            "Search ticket subjects and details"
+                        )
+                    
                     st.subheader("Filter Tickets")
                     col1, col2, col3 = st.columns(3)
                     with col1:
@@ -1220,7 +3058,7 @@ def support_ticket_page():
                     if category_filter != "All":
                         filtered_tickets = filtered_tickets[filtered_tickets['Category'] == category_filter]
                     
-                    for _, row in filtered_tickets.iterrows():
+                    for _, row in paginate_dataframe(filtered_tickets, "ticket_history", default_page_size=10).iterrows():
                         with st.expander(f"{row['Subject']} - {row['Status']} ({row['Priority']})"):
                             status_color = "red" if row['Status'] == "Open" else "green"
                             st.markdown(f"""
@@ -1256,14 +3094,7 @@ def support_ticket_page():
                                 st.write(row['Resolution Notes'])
                     
                     if not filtered_tickets.empty:
-                        csv = filtered_tickets.to_csv(index=False).encode('utf-8')
-                        st.download_button(
-                            "Download Tickets",
-                            csv,
-                            "my_support_tickets.csv",
-                            "text/csv",
-                            key='download-tickets-csv'
-                        )
+                        render_history_export(filtered_tickets, "ticket_history", "my_support_tickets", "Download Tickets")
                 else:
                     st.info("You haven't raised any support tickets yet.")
             else:
@@ -1364,6 +3195,7 @@ def travel_hotel_page():
                         success, error = log_travel_hotel_request(conn, request_df)
                         
                         if success:
+                            get_history_store(TRAVEL_HISTORY_SHEET).invalidate()
                             st.session_state.employee_email = employee_email.strip()
                             st.session_state.employee_phone = employee_phone.strip()
                             st.success(f"""
@@ -1455,6 +3287,7 @@ def travel_hotel_page():
                         success, error = log_travel_hotel_request(conn, request_df)
                         
                         if success:
+                            get_history_store(TRAVEL_HISTORY_SHEET).invalidate()
                             st.session_state.employee_email = employee_email.strip()
                             st.session_state.employee_phone = employee_phone.strip()
                             st.success(f"""
@@ -1468,14 +3301,10 @@ def travel_hotel_page():
     with tab3:
         st.subheader("My Travel & Hotel Requests")
         try:
-            requests_data = conn.read(worksheet=TRAVEL_HISTORY_SHEET, usecols=list(range(len(TRAVEL_HOTEL_COLUMNS))), ttl=5)
-            requests_data = requests_data.dropna(how="all")
+            travel_store = get_history_store(TRAVEL_HISTORY_SHEET)
+            my_requests = travel_store.for_employee(employee_code)
             
-            if not requests_data.empty:
-                my_requests = requests_data[
-                    requests_data['Employee Name'] == selected_employee
-                ].sort_values(by="Date Requested", ascending=False)
-                
+            if not travel_store.data.empty:
                 if not my_requests.empty:
                     pending_count = len(my_requests[my_requests['Status'] == "Pending"])
                     approved_count = len(my_requests[my_requests['Status'] == "Approved"])
@@ -1507,7 +3336,7 @@ def travel_hotel_page():
                     if type_filter != "All":
                         filtered_requests = filtered_requests[filtered_requests['Request Type'] == type_filter]
                     
-                    for _, row in filtered_requests.iterrows():
+                    for _, row in paginate_dataframe(filtered_requests, "travel_history", default_page_size=10).iterrows():
                         with st.expander(f"{row['Request Type']} - {row['Status']}"):
                             status_color = "orange" if row['Status'] == "Pending" else "green" if row['Status'] == "Approved" else "red"
                             st.markdown(f"""
@@ -1548,14 +3377,7 @@ def travel_hotel_page():
                                 st.write(row['Remarks'])
                     
                     if not filtered_requests.empty:
-                        csv = filtered_requests.to_csv(index=False).encode('utf-8')
-                        st.download_button(
-                            "Download Requests",
-                            csv,
-                            "my_travel_requests.csv",
-                            "text/csv",
-                            key='download-requests-csv'
-                        )
+                        render_history_export(filtered_requests, "travel_history", "my_travel_requests", "Download Requests")
                 else:
                     st.info("You haven't made any travel/hotel requests yet.")
             else:
@@ -1717,7 +3539,7 @@ def sales_page():
         if st.button("Generate Invoice", key="generate_invoice_button"):
             if selected_products and customer_name:
                 invoice_number = generate_invoice_number()
-                pdf, pdf_path = generate_invoice(
+                pdf_bytes, pdf_path = generate_invoice(
                     customer_name, gst_number, contact_number, address, selected_state, selected_city,
                     selected_products, quantities, product_discounts, discount_category,
                     selected_employee, payment_status, amount_paid, None, None,
@@ -1726,14 +3548,14 @@ def sales_page():
                     distributor_contact_number, distributor_email, distributor_territory,
                     "",
                 )
-                with open(pdf_path, "rb") as f:
-                    st.download_button(
-                        "Download Invoice",
-                        f,
-                        file_name=f"{invoice_number}.pdf",
-                        mime="application/pdf",
-                        key=f"download_{invoice_number}"
-                    )
+                st.download_button(
+                    "Download Invoice",
+                    pdf_bytes,
+                    file_name=f"{invoice_number}.pdf",
+                    mime="application/pdf",
+                    key=f"download_{invoice_number}"
+                )
+                get_history_store(INVOICE_SUMMARY_SHEET).invalidate()
                 st.success(f"Invoice {invoice_number} generated successfully!")
                 
             else:
@@ -1742,39 +3564,14 @@ def sales_page():
     with tab2:
         st.subheader("Your Sales History")
         
-        @st.cache_data(ttl=300)
-        def load_sales_data():
-            try:
-                sales_data = conn.read(worksheet=SALES_HISTORY_SHEET, ttl=5)
-                sales_data = sales_data.dropna(how='all')
-                
-                sales_data = sales_data.copy()
-                sales_data['Outlet Name'] = sales_data['Outlet Name'].astype(str)
-                sales_data['Invoice Number'] = sales_data['Invoice Number'].astype(str)
-                
-                try:
-                    sales_data['Invoice Date'] = pd.to_datetime(sales_data['Invoice Date'], dayfirst=True, errors='coerce')
-                except:
-                    sales_data['Invoice Date'] = pd.to_datetime(sales_data['Invoice Date'], errors='coerce')
-                
-                numeric_cols = ['Grand Total', 'Unit Price', 'Total Price', 'Product Discount (%)', 'Quantity']
-                for col in numeric_cols:
-                    if col in sales_data.columns:
-                        sales_data[col] = pd.to_numeric(sales_data[col], errors='coerce')
-                
-                employee_code = Person[Person['Employee Name'] == st.session_state.employee_name]['Employee Code'].values[0]
-                filtered_data = sales_data[sales_data['Employee Code'] == employee_code]
-                
-                filtered_data = filtered_data[filtered_data['Invoice Date'].notna()]
-                
-                return filtered_data
-            except Exception as e:
-                st.error(f"Error loading sales data: {e}")
-                return pd.DataFrame()
-    
-        sales_data = load_sales_data()
+        employee_code = Person[Person['Employee Name'] == selected_employee]['Employee Code'].values[0]
+        try:
+            invoice_query = get_history_store(INVOICE_SUMMARY_SHEET).query(employee_code, 'Invoice Date', ['Invoice Number', 'Outlet Name'])
+        except Exception as e:
+            st.error(f"Error loading invoice summary: {e}")
+            return
         
-        if sales_data.empty:
+        if len(invoice_query) == 0:
             st.warning("No sales records found for your account")
             return
             
@@ -1790,42 +3587,22 @@ def sales_page():
             if st.button("Apply Filters", key="search_sales_button"):
                 st.rerun()
         
-        filtered_data = sales_data.copy()
-        
-        if invoice_number_search:
-            filtered_data = filtered_data[
-                filtered_data['Invoice Number'].str.contains(invoice_number_search, case=False, na=False)
-            ]
-        
-        if invoice_date_search:
-            date_str = invoice_date_search.strftime("%d-%m-%Y")
-            filtered_data = filtered_data[
-                filtered_data['Invoice Date'].dt.strftime('%d-%m-%Y') == date_str
-            ]
-        
-        if outlet_name_search:
-            filtered_data = filtered_data[
-                filtered_data['Outlet Name'].str.contains(outlet_name_search, case=False, na=False)
-            ]
+        invoice_summary = invoice_query.filter(
+            date=invoice_date_search,
+            contains={'Invoice Number': invoice_number_search, 'Outlet Name': outlet_name_search}
+        )
         
-        if filtered_data.empty:
+        if invoice_summary.empty:
             st.warning("No matching records found")
             return
-            
-        invoice_summary = filtered_data.groupby('Invoice Number').agg({
-            'Invoice Date': 'first',
-            'Outlet Name': 'first',
-            'Grand Total': 'sum',
-            'Payment Status': 'first',
-            'Delivery Status': 'first'
-        }).reset_index()
         
-        invoice_summary = invoice_summary.sort_values('Invoice Date', ascending=False)
+        summary_columns = ['Invoice Number', 'Invoice Date', 'Outlet Name', 'Grand Total', 'Payment Status', 'Delivery Status']
         
-        st.write(f"📄 Showing {len(invoice_summary)} of your invoices")
+        st.write(f"📄 Found {len(invoice_summary)} of your invoices")
         
+        invoice_page = paginate_dataframe(invoice_summary, "invoice_history")
         st.dataframe(
-            invoice_summary,
+            invoice_page[summary_columns],
             column_config={
                 "Grand Total": st.column_config.NumberColumn(
                     format="₹%.2f",
@@ -1840,6 +3617,44 @@ def sales_page():
             hide_index=True
         )
         
+        try:
+            sales_data = get_history_store(SALES_HISTORY_SHEET).for_employee(employee_code)
+        except Exception as e:
+            st.error(f"Error loading sales data: {e}")
+            sales_data = pd.DataFrame()
+        
+        with st.expander("📦 Download Multiple Invoices"):
+            batch_invoices = st.multiselect(
+                "Select invoices",
+                invoice_summary['Invoice Number'].tolist(),
+                key="batch_invoice_selection"
+            )
+            batch_format = st.radio(
+                "Format",
+                list(INVOICE_BATCH_FORMATS),
+                horizontal=True,
+                key="batch_invoice_format"
+            )
+            if batch_invoices and not sales_data.empty and st.button("Prepare Download", key="batch_invoice_button"):
+                with st.spinner(f"Rendering {len(batch_invoices)} invoices..."):
+                    try:
+                        output_format = INVOICE_BATCH_FORMATS[batch_format]
+                        batch_data = render_invoice_batch(
+                            batch_invoices,
+                            output_format,
+                            invoice_lines=sales_data[sales_data['Invoice Number'].isin(batch_invoices)]
+                        )
+                        batch_name = f"invoices_{get_ist_time().strftime('%Y%m%d_%H%M%S')}"
+                        st.download_button(
+                            "📥 Download Invoices",
+                            batch_data,
+                            file_name=f"{batch_name}.{output_format}",
+                            mime="application/zip" if output_format == "zip" else "application/pdf",
+                            key="download_invoice_batch"
+                        )
+                    except Exception as e:
+                        st.error(f"Error rendering invoices: {e}")
+        
         selected_invoice = st.selectbox(
             "Select invoice to view details",
             invoice_summary['Invoice Number'],
@@ -1848,7 +3663,7 @@ def sales_page():
         
         st.subheader("Delivery Status Management")
         
-        invoice_details = filtered_data[filtered_data['Invoice Number'] == selected_invoice]
+        invoice_details = sales_data[sales_data['Invoice Number'] == selected_invoice] if not sales_data.empty else sales_data
         
         if not invoice_details.empty:
             with st.form(key='delivery_status_form'):
@@ -1874,9 +3689,14 @@ def sales_page():
                             all_sales_data.loc[mask, 'Delivery Status'] = new_status
                             
                             conn.update(worksheet="Sales", data=all_sales_data)
+                            success, error = update_invoice_summary_status(conn, selected_invoice, new_status)
+                            get_history_store(INVOICE_SUMMARY_SHEET).invalidate()
                             
-                            st.success(f"Delivery status updated to '{new_status}' for invoice {selected_invoice}!")
-                            st.rerun()
+                            if success:
+                                st.success(f"Delivery status updated to '{new_status}' for invoice {selected_invoice}!")
+                                st.rerun()
+                            else:
+                                st.warning(f"Delivery status updated to '{new_status}', but the invoice summary could not be updated: {error}")
                         except Exception as e:
                             st.error(f"Error updating delivery status: {e}")
         
@@ -1923,7 +3743,7 @@ def sales_page():
             if st.button("🔄 Regenerate Invoice", key=f"regenerate_btn_{selected_invoice}"):
                 with st.spinner("Regenerating invoice..."):
                     try:
-                        pdf, pdf_path = generate_invoice(
+                        pdf_bytes, pdf_path = generate_invoice(
                             str(invoice_data['Outlet Name']),
                             str(invoice_data.get('GST Number', '')),
                             str(invoice_data['Outlet Contact']),
@@ -1951,14 +3771,13 @@ def sales_page():
                             original_invoice_date 
                         )
                         
-                        with open(pdf_path, "rb") as f:
-                            st.download_button(
-                                "📥 Download Regenerated Invoice", 
-                                f, 
-                                file_name=f"{selected_invoice}.pdf",
-                                mime="application/pdf",
-                                key=f"download_regenerated_{selected_invoice}"
-                            )
+                        st.download_button(
+                            "📥 Download Regenerated Invoice", 
+                            pdf_bytes, 
+                            file_name=f"{selected_invoice}.pdf",
+                            mime="application/pdf",
+                            key=f"download_regenerated_{selected_invoice}"
+                        )
                         
                         st.success("Invoice regenerated successfully with original date!")
                         
@@ -2044,49 +3863,61 @@ def visit_page():
     
     with tab2:
         st.subheader("Previous Visits")
-        col1, col2, col3 = st.columns(3)
+        employee_code = Person[Person['Employee Name'] == selected_employee]['Employee Code'].values[0]
+        with st.expander("📝 Search Visit Notes"):
+            render_text_search(
+                VISIT_HISTORY_SHEET, employee_code, "visit_notes_search",
+                ['Visit ID', 'Visit Date', 'Outlet Name', 'Visit Notes', 'Remarks'],
+                "Search visit notes and remarks"
+            )
+        
+        visit_store = get_history_store(VISIT_HISTORY_SHEET)
+        col1, col2, col3, col4 = st.columns([3, 3, 3, 1])
         with col1:
             visit_id_search = st.text_input("Visit ID", key="visit_id_search")
         with col2:
-            visit_date_search = st.date_input("Visit Date", key="visit_date_search")
+            visit_date_search = st.date_input("Visit Date", value=None, key="visit_date_search")
         with col3:
             outlet_name_search = st.text_input("Outlet Name", key="visit_outlet_search")
+        with col4:
+            st.write("")
+            if st.button("🔄 Refresh", key="refresh_visits_button", help="Reload visits from the sheet"):
+                visit_store.invalidate()
+        
+        try:
+            visit_query = visit_store.query(employee_code, 'Visit Date', ['Visit ID', 'Outlet Name'])
+            # Inputs apply as soon as they change; the memo keeps paging and other reruns from filtering again
+            search_key = (visit_store.version, employee_code, visit_id_search, visit_date_search, outlet_name_search)
+            memo = st.session_state.get("visit_search_memo")
+            if memo is None or memo[0] != search_key:
+                filtered_data = visit_query.filter(
+                    date=visit_date_search,
+                    contains={'Visit ID': visit_id_search, 'Outlet Name': outlet_name_search}
+                )
+                if memo is None or memo[0][1:] != search_key[1:]:
+                    st.session_state.visit_history_page = 1
+                st.session_state.visit_search_memo = (search_key, filtered_data)
+            else:
+                filtered_data = memo[1]
             
-        if st.button("Search Visits", key="search_visits_button"):
-            try:
-                visit_data = conn.read(worksheet=VISIT_HISTORY_SHEET, ttl=5)
-                visit_data = visit_data.dropna(how="all")
-                
-                employee_code = Person[Person['Employee Name'] == selected_employee]['Employee Code'].values[0]
-                filtered_data = visit_data[visit_data['Employee Code'] == employee_code]
-                
-                if visit_id_search:
-                    filtered_data = filtered_data[filtered_data['Visit ID'].str.contains(visit_id_search, case=False)]
-                if visit_date_search:
-                    date_str = visit_date_search.strftime("%d-%m-%Y")
-                    filtered_data = filtered_data[filtered_data['Visit Date'] == date_str]
-                if outlet_name_search:
-                    filtered_data = filtered_data[filtered_data['Outlet Name'].str.contains(outlet_name_search, case=False)]
+            if not filtered_data.empty:
+                display_columns = [
+                    'Visit ID', 'Visit Date', 'Outlet Name', 'Visit Purpose', 'Visit Notes',
+                    'Entry Time', 'Exit Time', 'Visit Duration (minutes)', 'Remarks'
+                ]
+                visit_page_rows = paginate_dataframe(filtered_data, "visit_history")
+                st.dataframe(
+                    visit_page_rows[display_columns],
+                    column_config={"Visit Date": st.column_config.DateColumn(format="DD/MM/YYYY")}
+                )
                 
-                if not filtered_data.empty:
-                    display_columns = [
-                        'Visit ID', 'Visit Date', 'Outlet Name', 'Visit Purpose', 'Visit Notes',
-                        'Entry Time', 'Exit Time', 'Visit Duration (minutes)', 'Remarks'
-                    ]
-                    st.dataframe(filtered_data[display_columns])
-                    
-                    csv = filtered_data.to_csv(index=False).encode('utf-8')
-                    st.download_button(
-                        "Download as CSV",
-                        csv,
-                        "visit_history.csv",
-                        "text/csv",
-                        key='download-visit-csv'
-                    )
-                else:
-                    st.warning("No matching visit records found")
-            except Exception as e:
-                st.error(f"Error retrieving visit data: {e}")
+                render_history_export(filtered_data, "visit_history", "visit_history", "Download")
+            elif len(visit_query) == 0:
+                st.info("No visits recorded yet.")
+            else:
+                st.warning("No matching visit records found")
+        except Exception as e:
+            st.error(f"Error retrieving visit data: {e}")
 
 def attendance_page():
     hourly_location_auto_log(conn, st.session_state.employee_name)
@@ -2094,22 +3925,12 @@ def attendance_page():
     selected_employee = st.session_state.employee_name
 
     # Check if attendance already recorded today
-    if check_existing_attendance(selected_employee):
+    today_record = get_today_attendance(selected_employee)
+    if today_record is not None:
         st.warning("You have already marked your attendance for today.")
         
         # Show existing attendance record
         try:
-            existing_data = conn.read(worksheet="Attendance", usecols=list(range(len(ATTENDANCE_SHEET_COLUMNS))), ttl=5)
-            existing_data = existing_data.dropna(how='all')
-            
-            current_date = get_ist_time().strftime("%d-%m-%Y")
-            employee_code = Person[Person['Employee Name'] == selected_employee]['Employee Code'].values[0]
-            
-            today_record = existing_data[
-                (existing_data['Employee Code'] == employee_code) & 
-                (existing_data['Date'] == current_date)
-            ].iloc[0]
-            
             st.subheader("Your Attendance Record for Today")
             col1, col2 = st.columns(2)
             with col1:
@@ -2163,6 +3984,11 @@ def attendance_page():
         if lat and lng:
             gmaps_link = f"https://maps.google.com/?q={lat},{lng}"
             st.success(f"Fetched Location: [View on Google Maps]({gmaps_link})")
+            geofence = get_geofence_index().classify(lat, lng)
+            if geofence[0] == "Unverified":
+                st.caption("No geofence locations are configured, so this check-in will not be verified.")
+            else:
+                st.info(f"📍 {geofence[0]} — nearest: {geofence[1]} ({geofence[2]:,} m away)")
         else:
             gmaps_link = ""
             st.info("Waiting for location permission...")
@@ -2174,7 +4000,8 @@ def attendance_page():
                     selected_employee,
                     status,
                     location_link=gmaps_link,
-                    leave_reason=remarks
+                    leave_reason=remarks,
+                    geofence=geofence
                 )
                 if error:
                     st.error(f"Failed to record attendance: {error}")
@@ -2211,9 +4038,601 @@ def attendance_page():
                         time.sleep(2)
                         st.rerun()
 
+MANAGER_EMPLOYEE_CODES = {
+    code.strip() for code in os.environ.get("MANAGER_EMPLOYEE_CODES", "").split(",") if code.strip()
+}
+
+def is_manager(employee_name):
+    codes = Person.loc[Person['Employee Name'] == employee_name, 'Employee Code']
+    return not codes.empty and codes.iloc[0] in MANAGER_EMPLOYEE_CODES
+
+def sales_overview_tab():
+    try:
+        rollups = load_sales_rollups()
+    except Exception as e:
+        st.error(f"Error loading sales rollups: {e}")
+        return
+    
+    if rollups.empty:
+        st.info("No sales recorded yet.")
+        return
+    
+    first_date = rollups['Date'].min().date()
+    last_date = rollups['Date'].max().date()
+    col1, col2 = st.columns(2)
+    with col1:
+        start_date = st.date_input("From", value=max(first_date, last_date - timedelta(days=30)),
+                                   min_value=first_date, max_value=last_date, key="dashboard_start")
+    with col2:
+        end_date = st.date_input("To", value=last_date, min_value=first_date, max_value=last_date, key="dashboard_end")
+    
+    window = rollups[(rollups['Date'] >= pd.Timestamp(start_date)) & (rollups['Date'] <= pd.Timestamp(end_date))]
+    # Every line item falls in exactly one zone, so the zone rows give the overall totals
+    totals = window[window['Dimension'] == "Zone"]
+    
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Sales (incl. GST)", f"₹{totals['Grand Total'].sum():,.2f}")
+    col2.metric("Units", f"{int(totals['Quantity'].sum()):,}")
+    col3.metric("Line Items", f"{int(totals['Line Items'].sum()):,}")
+    
+    st.subheader("Daily Sales")
+    st.line_chart(totals.groupby('Date')['Grand Total'].sum())
+    
+    for dimension, title in [
+        ("Zone", "Sales by Zone"),
+        ("Product Category", "Sales by Product Category"),
+        ("Distributor", "Top Distributors"),
+        ("Employee", "Top Employees")
+    ]:
+        st.subheader(title)
+        by_key = (
+            window[window['Dimension'] == dimension]
+            .groupby('Key')['Grand Total'].sum()
+            .sort_values(ascending=False)
+            .head(15)
+        )
+        st.bar_chart(by_key)
+
+DAILY_TRAVEL_COLUMNS = [
+    "Employee Code", "Employee Name", "Date", "Pings", "First Ping", "Last Ping", "Distance (km)", "Route"
+]
+
+def _parse_repeated(values, parse):
+    """Parse each distinct string once; pings repeat the same dates and times many times over"""
+    codes, uniques = pd.factorize(values.astype(str))
+    return parse(pd.Index(uniques)).to_numpy()[codes]
+
+def compute_daily_travel(rows):
+    """Per employee per day: distance travelled between consecutive pings and the encoded route"""
+    if rows.empty:
+        return pd.DataFrame(columns=DAILY_TRAVEL_COLUMNS)
+    dates = _parse_repeated(rows["Date"], lambda v: pd.to_datetime(v, format="%d-%m-%Y", errors='coerce'))
+    clock = _parse_repeated(rows["Time"], lambda v: pd.to_timedelta(v.str.slice(0, 5) + ":00", errors='coerce'))
+    pings = pd.DataFrame({
+        "Employee Code": rows["Employee Code"].astype(str).to_numpy(),
+        "Employee Name": rows["Employee Name"].to_numpy(),
+        "Date": dates,
+        "Timestamp": dates + clock,
+        "Latitude": pd.to_numeric(rows["Latitude"], errors='coerce').to_numpy(),
+        "Longitude": pd.to_numeric(rows["Longitude"], errors='coerce').to_numpy()
+    }).dropna(subset=["Timestamp", "Latitude", "Longitude"])
+    if pings.empty:
+        return pd.DataFrame(columns=DAILY_TRAVEL_COLUMNS)
+    pings = pings.sort_values(["Employee Code", "Timestamp"], kind='stable').reset_index(drop=True)
+    
+    lat = pings["Latitude"].to_numpy()
+    lng = pings["Longitude"].to_numpy()
+    codes = pings["Employee Code"].to_numpy()
+    days = pings["Date"].to_numpy()
+    timestamps = pings["Timestamp"].to_numpy()
+    # Rows are sorted, so each employee-day is a contiguous run; a segment counts only inside a run
+    same_trip = np.zeros(len(pings), dtype=bool)
+    same_trip[1:] = (codes[1:] == codes[:-1]) & (days[1:] == days[:-1])
+    segment_m = np.zeros(len(pings))
+    segment_m[1:] = haversine_m(lat[:-1], lng[:-1], lat[1:], lng[1:])
+    segment_m[~same_trip] = 0.0
+    
+    starts = np.flatnonzero(~same_trip)
+    ends = np.append(starts[1:], len(pings))
+    daily = pd.DataFrame({
+        "Employee Code": codes[starts],
+        "Employee Name": pings["Employee Name"].to_numpy()[starts],
+        "Date": days[starts],
+        "Pings": ends - starts,
+        "First Ping": timestamps[starts],
+        "Last Ping": timestamps[ends - 1],
+        "Distance (km)": (np.add.reduceat(segment_m, starts) / 1000).round(2),
+        "Route": encode_polylines(lat, lng, starts)
+    })
+    return daily[DAILY_TRAVEL_COLUMNS]
+
+@st.cache_data(ttl=HISTORY_CACHE_TTL)
+def load_daily_travel(start_date, end_date):
+    return compute_daily_travel(read_location_history(conn, start_date, end_date))
+
+def travel_distance_tab():
+    today = get_ist_time().date()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        start_date = st.date_input("From", value=today - timedelta(days=30), max_value=today, key="travel_distance_start")
+    with col2:
+        end_date = st.date_input("To", value=today, max_value=today, key="travel_distance_end")
+    
+    # Only the months this range touches are loaded
+    try:
+        window = load_daily_travel(start_date, end_date)
+    except Exception as e:
+        st.error(f"Error loading location history: {e}")
+        return
+    
+    with col3:
+        employee_filter = st.selectbox("Employee", ["All"] + sorted(window['Employee Name'].dropna().unique()), key="travel_distance_employee")
+    if employee_filter != "All":
+        window = window[window['Employee Name'] == employee_filter]
+    if window.empty:
+        st.warning("No travel recorded in this period.")
+        return
+    
+    st.metric("Total Distance", f"{window['Distance (km)'].sum():,.1f} km")
+    st.subheader("Distance by Employee")
+    st.bar_chart(window.groupby('Employee Name')['Distance (km)'].sum().sort_values(ascending=False))
+    
+    st.subheader("Daily Distance")
+    daily_table = window.drop(columns=['Route'])
+    travel_page_rows = paginate_dataframe(daily_table, "travel_distance")
+    st.dataframe(
+        travel_page_rows,
+        column_config={"Date": st.column_config.DateColumn(format="DD/MM/YYYY")},
+        use_container_width=True,
+        hide_index=True
+    )
+    render_history_export(window, "travel_distance", "daily_travel", "Download Distances")
+    
+    st.subheader("Route")
+    labels = window['Employee Name'] + " · " + window['Date'].dt.strftime('%d-%m-%Y')
+    selected = st.selectbox("Select a day to view its route", labels.tolist(), key="travel_distance_route")
+    route = decode_polyline(window.loc[labels == selected, 'Route'].iloc[0])
+    st.map(pd.DataFrame(route, columns=['lat', 'lon']))
+
+ATTENDANCE_LATE_AFTER = os.environ.get("ATTENDANCE_LATE_AFTER", "10:00")
+ATTENDANCE_STATUSES = ["Present", "Half Day", "Leave"]
+ATTENDANCE_REPORT_COLUMNS = [
+    "Month", "Employee Code", "Employee Name", "Designation",
+    "Present", "Half Day", "Leave", "Days Recorded", "Late Check-ins", "Leave Reasons"
+]
+ATTENDANCE_REPORT_PDF_COLUMNS = [
+    ("Employee Name", 55, 'L'),
+    ("Employee Code", 25, 'L'),
+    ("Present", 18, 'C'),
+    ("Half Day", 18, 'C'),
+    ("Leave", 18, 'C'),
+    ("Late Check-ins", 25, 'C'),
+    ("Leave Reasons", 118, 'L')
+]
+
+def build_attendance_report(attendance, start_date, end_date):
+    """Per employee per month: status counts, late check-ins and leave reasons"""
+    dates = pd.to_datetime(attendance["Date"], format="%d-%m-%Y", errors='coerce')
+    records = attendance.assign(Date=dates)
+    records = records[(dates >= pd.Timestamp(start_date)) & (dates <= pd.Timestamp(end_date))]
+    # Only the first record an employee made on a day counts
+    records = records.drop_duplicates(subset=["Employee Code", "Date"], keep="first")
+    records = records.assign(
+        Month=records["Date"].dt.strftime("%Y-%m"),
+        Status=records["Status"].fillna("").astype(str).str.strip()
+    )
+    
+    check_in = pd.to_timedelta(records["Check-in Time"].astype(str).str.slice(0, 8), errors='coerce')
+    late_after = pd.to_timedelta(f"{ATTENDANCE_LATE_AFTER}:00")
+    records["Late"] = (check_in > late_after) & records["Status"].isin(["Present", "Half Day"])
+    
+    keys = ["Month", "Employee Code"]
+    counts = records.pivot_table(index=keys, columns="Status", values="Date", aggfunc="count", fill_value=0)
+    counts = counts.reindex(columns=ATTENDANCE_STATUSES, fill_value=0)
+    counts["Days Recorded"] = records.groupby(keys).size()
+    counts["Late Check-ins"] = records.groupby(keys)["Late"].sum()
+    
+    leave = records[records["Status"] == "Leave"]
+    leave_reasons = leave["Date"].dt.strftime("%d %b") + ": " + leave["Leave Reason"].fillna("").astype(str)
+    counts["Leave Reasons"] = leave_reasons.groupby([leave["Month"], leave["Employee Code"]]).agg("; ".join)
+    counts = counts.reset_index()
+    
+    # Employees with no records in a month still get a row of zeros
+    months = pd.period_range(pd.Timestamp(start_date), pd.Timestamp(end_date), freq="M").strftime("%Y-%m")
+    roster = Person[["Employee Code", "Employee Name", "Designation"]].drop_duplicates(subset="Employee Code")
+    grid = pd.MultiIndex.from_product([months, roster["Employee Code"]], names=keys).to_frame(index=False)
+    report = grid.merge(roster, on="Employee Code", how="left").merge(counts, on=keys, how="left")
+    
+    numeric = ATTENDANCE_STATUSES + ["Days Recorded", "Late Check-ins"]
+    report[numeric] = report[numeric].fillna(0).astype(int)
+    report["Leave Reasons"] = report["Leave Reasons"].fillna("")
+    return report.sort_values(["Month", "Employee Name"])[ATTENDANCE_REPORT_COLUMNS].reset_index(drop=True)
+
+def _pdf_text(value):
+    return str(value).encode('latin-1', 'replace').decode('latin-1')
+
+def attendance_report_pdf(report, title):
+    pdf = FPDF(orientation='L')
+    pdf.set_auto_page_break(auto=True, margin=12)
+    pdf.add_page()
+    pdf.set_font("Arial", 'B', 14)
+    pdf.cell(0, 10, _pdf_text(title), ln=True, align='C')
+    pdf.set_font("Arial", '', 9)
+    pdf.cell(0, 6, _pdf_text(f"{company_name} - late means checked in after {ATTENDANCE_LATE_AFTER}"), ln=True, align='C')
+    pdf.ln(2)
+    
+    def draw_header():
+        pdf.set_font("Arial", 'B', 9)
+        pdf.set_fill_color(200, 220, 255)
+        for column, width, _ in ATTENDANCE_REPORT_PDF_COLUMNS:
+            pdf.cell(width, 8, column, border=1, align='C', fill=True)
+        pdf.ln()
+        pdf.set_font("Arial", '', 8)
+    
+    draw_header()
+    for row in report.to_dict('records'):
+        reasons = wrap_text_to_width(pdf, _pdf_text(row["Leave Reasons"]), ATTENDANCE_REPORT_PDF_COLUMNS[-1][1] - 2) or [""]
+        height = 6 * len(reasons)
+        if pdf.get_y() + height > pdf.h - 12:
+            pdf.add_page()
+            draw_header()
+        y = pdf.get_y()
+        for column, width, align in ATTENDANCE_REPORT_PDF_COLUMNS[:-1]:
+            pdf.cell(width, height, _pdf_text(row[column]), border=1, align=align)
+        pdf.multi_cell(ATTENDANCE_REPORT_PDF_COLUMNS[-1][1], 6, "\n".join(reasons), border=1)
+        pdf.set_y(y + height)
+    return pdf_to_bytes(pdf)
+
+@st.cache_data(ttl=HISTORY_CACHE_TTL, max_entries=24)
+def load_attendance_report(start_date, end_date):
+    attendance = read_partitioned_rows(conn, "Attendance", start_date, end_date)
+    return build_attendance_report(attendance, start_date, end_date)
+
+def attendance_report_tab():
+    months = pd.period_range(end=pd.Timestamp(get_ist_time().date()), periods=12, freq="M")[::-1]
+    col1, col2 = st.columns(2)
+    with col1:
+        first_month = st.selectbox("From month", months, format_func=lambda m: m.strftime("%B %Y"), key="attendance_report_from")
+    with col2:
+        last_month = st.selectbox("To month", months, format_func=lambda m: m.strftime("%B %Y"), key="attendance_report_to")
+    if first_month > last_month:
+        st.error("'From month' must not be after 'To month'.")
+        return
+    
+    try:
+        report = load_attendance_report(first_month.start_time.date(), last_month.end_time.date())
+    except Exception as e:
+        st.error(f"Error loading attendance: {e}")
+        return
+    
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Present Days", f"{report['Present'].sum():,}")
+    col2.metric("Half Days", f"{report['Half Day'].sum():,}")
+    col3.metric("Leave Days", f"{report['Leave'].sum():,}")
+    col4.metric("Late Check-ins", f"{report['Late Check-ins'].sum():,}")
+    
+    st.dataframe(report, use_container_width=True, hide_index=True)
+    
+    label = first_month.strftime("%B %Y") if first_month == last_month else f"{first_month.strftime('%b %Y')} - {last_month.strftime('%b %Y')}"
+    file_stem = f"attendance_{first_month.strftime('%Y_%m')}" + ("" if first_month == last_month else f"_to_{last_month.strftime('%Y_%m')}")
+    signature = (file_stem, frame_signature(report))
+    col1, col2 = st.columns(2)
+    with col1:
+        render_prepared_download(
+            "attendance_report_xlsx",
+            signature,
+            lambda: write_xlsx_export(report, sheet_name="Attendance"),
+            "Download XLSX",
+            f"{file_stem}.xlsx",
+            EXPORT_FORMATS["Excel"][1],
+            prepare_label="Prepare XLSX"
+        )
+    with col2:
+        render_prepared_download(
+            "attendance_report_pdf",
+            signature,
+            lambda: attendance_report_pdf(report, f"Attendance Report - {label}"),
+            "Download PDF",
+            f"{file_stem}.pdf",
+            "application/pdf",
+            prepare_label="Prepare PDF"
+        )
+
+VISIT_PING_TOLERANCE_MINUTES = 60
+VISIT_MATCH_RADIUS_M = int(os.environ.get("VISIT_MATCH_RADIUS_M", "300"))
+VISIT_RECONCILIATION_GRACE_DAYS = 2
+VISIT_RECONCILIATION_CLOSED_TTL = 6 * 3600
+VISIT_RECONCILIATION_COLUMNS = [
+    "Visit ID", "Employee Code", "Employee Name", "Outlet Name", "Visit Time",
+    "Ping Time", "Minutes From Ping", "Distance (m)", "Reconciliation"
+]
+
+def reconcile_visits(visits, pings, outlets):
+    """Match each visit to the employee's nearest-in-time ping and measure how far it was from the outlet"""
+    if visits.empty:
+        return pd.DataFrame(columns=VISIT_RECONCILIATION_COLUMNS)
+    visit_dates = pd.Series(pd.to_datetime(visits["Visit Date"], format="%d-%m-%Y", errors='coerce').to_numpy())
+    entry = pd.Series(_parse_repeated(visits["Entry Time"], lambda v: pd.to_timedelta(v.str.slice(0, 8), errors='coerce')))
+    exit_ = pd.Series(_parse_repeated(visits["Exit Time"], lambda v: pd.to_timedelta(v.str.slice(0, 8), errors='coerce')))
+    left = pd.DataFrame({
+        "Visit ID": visits["Visit ID"].to_numpy(),
+        "Employee Code": visits["Employee Code"].astype(str).to_numpy(),
+        "Employee Name": visits["Employee Name"].to_numpy(),
+        "Outlet Name": visits["Outlet Name"].to_numpy(),
+        # The midpoint of the visit is the moment the rep should most clearly be at the outlet
+        "Visit Time": (visit_dates + entry + (exit_.fillna(entry) - entry) / 2).to_numpy()
+    }).dropna(subset=["Visit Time"]).sort_values("Visit Time")
+    
+    right = pd.DataFrame({
+        "Employee Code": pings["Employee Code"].astype(str).to_numpy(),
+        "Ping Time": _parse_repeated(pings["Date"], lambda v: pd.to_datetime(v, format="%d-%m-%Y", errors='coerce'))
+                     + _parse_repeated(pings["Time"], lambda v: pd.to_timedelta(v.str.slice(0, 5) + ":00", errors='coerce')),
+        "Ping Latitude": pd.to_numeric(pings["Latitude"], errors='coerce').to_numpy(),
+        "Ping Longitude": pd.to_numeric(pings["Longitude"], errors='coerce').to_numpy()
+    }).dropna().sort_values("Ping Time")
+    
+    matched = pd.merge_asof(
+        left, right,
+        left_on="Visit Time", right_on="Ping Time", by="Employee Code",
+        direction="nearest", tolerance=pd.Timedelta(minutes=VISIT_PING_TOLERANCE_MINUTES)
+    )
+    
+    outlet_points = outlets.assign(outlet_key=outlets["Name"].astype(str).str.strip().str.lower())
+    outlet_points = outlet_points.drop_duplicates(subset="outlet_key")[["outlet_key", "Latitude", "Longitude"]]
+    matched = matched.assign(outlet_key=matched["Outlet Name"].astype(str).str.strip().str.lower())
+    matched = matched.merge(outlet_points, on="outlet_key", how="left")
+    
+    matched["Minutes From Ping"] = ((matched["Ping Time"] - matched["Visit Time"]).abs().dt.total_seconds() / 60).round()
+    matched["Distance (m)"] = haversine_m(
+        matched["Ping Latitude"].to_numpy(dtype=float), matched["Ping Longitude"].to_numpy(dtype=float),
+        matched["Latitude"].to_numpy(dtype=float), matched["Longitude"].to_numpy(dtype=float)
+    ).round()
+    matched["Reconciliation"] = np.select(
+        [matched["Latitude"].isna(), matched["Ping Time"].isna(), matched["Distance (m)"] <= VISIT_MATCH_RADIUS_M],
+        ["Outlet Not Geocoded", "No Nearby Ping", "Verified"],
+        default="Far From Outlet"
+    )
+    return matched[VISIT_RECONCILIATION_COLUMNS]
+
+def compute_visit_reconciliation(day, visits):
+    # Pings from the neighbouring days cover visits near midnight
+    pings = read_location_history(conn, day - timedelta(days=1), day + timedelta(days=1))
+    outlets = get_geofence_index().locations
+    return reconcile_visits(visits, pings, outlets[outlets["Type"] == "Outlet"])
+
+# The day's visits and the geofence file times are part of the cache key, so late visit
+# replays and geofence edits are picked up; the TTLs cover location pings that land late
+
+@st.cache_data(ttl=VISIT_RECONCILIATION_CLOSED_TTL, max_entries=120)
+def _closed_day_reconciliation(day, visits, geofence_signature):
+    return compute_visit_reconciliation(day, visits)
+
+@st.cache_data(ttl=HISTORY_CACHE_TTL)
+def _open_day_reconciliation(day, visits, geofence_signature):
+    return compute_visit_reconciliation(day, visits)
+
+def load_visit_reconciliation(day):
+    """Days past the grace period are cached for hours; recent days are recomputed as pings and replays arrive"""
+    visits = get_history_store(VISIT_HISTORY_SHEET).snapshot()
+    if not visits.empty:
+        visits = visits[visits["Visit Date"].dt.date == day]
+    if day < get_ist_time().date() - timedelta(days=VISIT_RECONCILIATION_GRACE_DAYS):
+        return _closed_day_reconciliation(day, visits, geofence_files_signature())
+    return _open_day_reconciliation(day, visits, geofence_files_signature())
+
+def visit_check_tab():
+    today = get_ist_time().date()
+    day = st.date_input("Visit Date", value=today - timedelta(days=1), max_value=today, key="visit_check_date")
+    try:
+        reconciliation = load_visit_reconciliation(day)
+    except Exception as e:
+        st.error(f"Error reconciling visits: {e}")
+        return
+    
+    if reconciliation.empty:
+        st.info("No visits recorded on this day.")
+        return
+    
+    outcomes = reconciliation["Reconciliation"].value_counts()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Verified", int(outcomes.get("Verified", 0)))
+    col2.metric("Far From Outlet", int(outcomes.get("Far From Outlet", 0)))
+    col3.metric("No Nearby Ping", int(outcomes.get("No Nearby Ping", 0)))
+    col4.metric("Outlet Not Geocoded", int(outcomes.get("Outlet Not Geocoded", 0)))
+    st.caption(f"A visit is verified when the rep's closest ping within {VISIT_PING_TOLERANCE_MINUTES} minutes "
+               f"is no more than {VISIT_MATCH_RADIUS_M} m from the outlet.")
+    
+    show_all = st.checkbox("Show verified visits too", key="visit_check_show_all")
+    shown = reconciliation if show_all else reconciliation[reconciliation["Reconciliation"] != "Verified"]
+    st.dataframe(shown, use_container_width=True, hide_index=True)
+    render_history_export(shown, "visit_check", f"visit_check_{day:%Y_%m_%d}", "Download")
+
+def manager_dashboard_page():
+    if not is_manager(st.session_state.employee_name):
+        st.error("The dashboard is only available to managers.")
+        return
+    st.title("Manager Dashboard")
+    
+    tabs = st.tabs(["Sales Overview", "Demo Conversion", "Travel Distance", "Attendance Report", "Visit Check"])
+    with tabs[0]:
+        sales_overview_tab()
+    with tabs[1]:
+        try:
+            demo_products = get_history_store(DEMO_PRODUCTS_SHEET).snapshot()
+        except Exception as e:
+            st.error(f"Error loading demonstrated products: {e}")
+        else:
+            render_demo_insights(demo_products)
+    with tabs[2]:
+        travel_distance_tab()
+    with tabs[3]:
+        attendance_report_tab()
+    with tabs[4]:
+        visit_check_tab()
+
+ADMIN_EMPLOYEE_CODES = {
+    code.strip() for code in os.environ.get("ADMIN_EMPLOYEE_CODES", "").split(",") if code.strip()
+}
+
+def is_admin(employee_name):
+    codes = Person.loc[Person['Employee Name'] == employee_name, 'Employee Code']
+    return not codes.empty and codes.iloc[0] in ADMIN_EMPLOYEE_CODES
+
+def _load_saved_query():
+    st.session_state.sql_console_query = st.session_state.sql_saved_queries[st.session_state.sql_console_saved]
+
+# Derived sheet: (source history sheet, source columns, drift check, rebuild)
+DERIVED_SHEETS = {
+    INVOICE_SUMMARY_SHEET: (SALES_HISTORY_SHEET, None, invoice_summary_lags, rebuild_invoice_summary),
+    SALES_ROLLUP_SHEET: (SALES_HISTORY_SHEET, None, sales_rollups_lag, rebuild_sales_rollups),
+    DEMO_PRODUCTS_SHEET: (DEMO_HISTORY_SHEET, DEMO_SHEET_COLUMNS, demo_products_lag, rebuild_demo_products)
+}
+
+def reconcile_derived_sheets(conn, force=False):
+    """Rebuild the derived sheets that have fallen behind their source history, or all of them when forced"""
+    sources = {}
+    rebuilt = {}
+    for sheet, (source_sheet, source_columns, lags, rebuild) in DERIVED_SHEETS.items():
+        if source_sheet not in sources:
+            sources[source_sheet] = read_history_source(conn, source_sheet, source_columns)
+        if force or lags(conn, sources[source_sheet]):
+            rebuilt[sheet] = len(rebuild(conn, sources[source_sheet]))
+            if sheet in HISTORY_SOURCES:
+                get_history_store(sheet).invalidate()
+    if SALES_ROLLUP_SHEET in rebuilt:
+        load_sales_rollups.clear()
+    return rebuilt
+
+class DerivedSheetReconciler:
+    """Background job that checks the derived sheets against their source history every DERIVED_SHEET_REBUILD_INTERVAL"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.last_run = None
+        self.last_rebuilt = {}
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="derived-sheet-reconcile", daemon=True)
+        self._worker.start()
+
+    def run_once(self, force=False):
+        with self._lock:
+            try:
+                self.last_rebuilt = reconcile_derived_sheets(conn, force)
+                self.last_error = None
+                return self.last_rebuilt
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+            finally:
+                self.last_run = time.time()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Derived sheet reconciliation failed")
+            time.sleep(self.interval)
+
+@st.cache_resource
+def get_derived_sheet_reconciler():
+    return DerivedSheetReconciler(DERIVED_SHEET_REBUILD_INTERVAL)
+
+def render_derived_sheet_maintenance():
+    reconciler = get_derived_sheet_reconciler()
+    with st.expander("🛠 Derived Sheets"):
+        st.caption(
+            "A background job checks the derived sheets against their source history at startup and "
+            f"every {DERIVED_SHEET_REBUILD_INTERVAL // 3600} hours, and rebuilds any that have fallen behind."
+        )
+        if reconciler.last_run:
+            last_run = datetime.fromtimestamp(reconciler.last_run, pytz.timezone('Asia/Kolkata')).strftime("%d-%m-%Y %H:%M")
+            if reconciler.last_error:
+                st.warning(f"Last check at {last_run} failed: {reconciler.last_error}")
+            else:
+                st.caption(f"Last check at {last_run}; rebuilt: {', '.join(reconciler.last_rebuilt) or 'none'}")
+        if st.button("Rebuild now", key="rebuild_derived_sheets"):
+            with st.spinner("Rebuilding derived sheets..."):
+                try:
+                    rebuilt = reconciler.run_once(force=True)
+                    st.success("Rebuilt " + ", ".join(f"{sheet} ({rows:,} rows)" for sheet, rows in rebuilt.items()))
+                except Exception as e:
+                    st.error(f"Error rebuilding derived sheets: {e}")
+
+def render_partition_migration():
+    if not MONTHLY_PARTITIONS_ENABLED:
+        return
+    with st.expander("🗂 Monthly Partitions"):
+        st.caption(
+            "Monthly partitions are on. Rows still in the original sheets are read alongside the monthly "
+            "worksheets until they are split into them."
+        )
+        for sheet in PARTITIONED_SHEETS:
+            if st.button(f"Split {sheet} into monthly worksheets", key=f"split_{sheet}"):
+                with st.spinner(f"Splitting {sheet}..."):
+                    try:
+                        moved = split_sheet_into_partitions(conn, sheet)
+                        st.success(f"Moved {moved:,} rows from {sheet} into its monthly worksheets.")
+                    except Exception as e:
+                        st.error(f"Error splitting {sheet}: {e}")
+
+def sql_console_page():
+    if not is_admin(st.session_state.employee_name):
+        st.error("The SQL console is only available to admins.")
+        return
+    st.title("SQL Console")
+    render_derived_sheet_maintenance()
+    render_partition_migration()
+    
+    if duckdb is None:
+        st.error("The SQL console needs the duckdb package. Install it with `pip install duckdb`.")
+        return
+    
+    st.caption("Read-only queries over the cached history. Tables: " + ", ".join(f"`{name}`" for name in SQL_CONSOLE_TABLES))
+    
+    st.session_state.sql_saved_queries = load_saved_queries()
+    st.selectbox(
+        "Saved queries",
+        list(st.session_state.sql_saved_queries),
+        index=None,
+        placeholder="Load a saved query",
+        key="sql_console_saved",
+        on_change=_load_saved_query
+    )
+    sql = st.text_area("Query", key="sql_console_query", height=200)
+    
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        run_query = st.button("Run", type="primary", key="sql_console_run")
+    with col2:
+        with st.popover("Save query"):
+            query_name = st.text_input("Name", key="sql_console_save_name")
+            if st.button("Save", key="sql_console_save"):
+                if not query_name or not sql.strip():
+                    st.error("Enter a name and a query to save.")
+                else:
+                    success, error = save_query(query_name, sql)
+                    if success:
+                        st.success(f"Saved '{query_name}'.")
+                    else:
+                        st.error(f"Could not save query: {error}")
+    
+    if run_query and sql.strip():
+        start = time.perf_counter()
+        result, error = get_analytics_engine().run(sql)
+        if error:
+            st.error(error)
+        else:
+            st.caption(f"{len(result):,} rows in {(time.perf_counter() - start) * 1000:.0f} ms"
+                       + (f" (limited to {SQL_CONSOLE_ROW_LIMIT:,})" if len(result) == SQL_CONSOLE_ROW_LIMIT else ""))
+            st.dataframe(result, use_container_width=True, hide_index=True)
+            render_history_export(result, "sql_console", "query_result", "Download Result")
+
 def main():
     if not cookies.ready():
         st.stop()
+    get_derived_sheet_reconciler()
 
     if 'authenticated' not in st.session_state:
         st.session_state.authenticated = cookies.get('authenticated') == 'true'
@@ -2221,8 +4640,8 @@ def main():
         st.session_state.selected_mode = None
 
     if st.session_state.authenticated and st.session_state.employee_name:
+        render_pending_submissions(st.session_state.employee_name)
         st.title("Select Mode")
-        cols = st.columns(7)
         
         modes = [
             ("Sales", "sales_mode"),
@@ -2233,6 +4652,11 @@ def main():
             ("Travel/Hotel", "travel_mode"),
             ("Demo", "demo_mode")
         ]
+        if is_manager(st.session_state.employee_name):
+            modes.append(("Dashboard", "dashboard_mode"))
+        if is_admin(st.session_state.employee_name):
+            modes.append(("SQL Console", "sql_console_mode"))
+        cols = st.columns(len(modes))
         
         for (mode_name, mode_key), col in zip(modes, cols):
             with col:
@@ -2250,7 +4674,9 @@ def main():
                 "Resources": resources_page,
                 "Support Ticket": support_ticket_page,
                 "Travel/Hotel": travel_hotel_page,
-                "Demo": demo_page
+                "Demo": demo_page,
+                "Dashboard": manager_dashboard_page,
+                "SQL Console": sql_console_page
             }
             
             if st.session_state.selected_mode in page_functions: